@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: DedupMiddleware(LRU + batched async lookups) vs. one ZRANK per request
+#
+#   $ PYTHONPATH=. python scripts/bench-dedup-urls.py [requests] [rtt_ms]
+#
+# redis is replaced by an in-process stand-in that sleeps rtt per round trip.
+# "reactor" is the time spent inside process_request(the reactor is blocked).
+#
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request
+from scrapy.spider import Spider
+from scrapy.statscol import MemoryStatsCollector
+from scrapy.utils.project import get_project_settings
+from twisted.internet import reactor
+from webbot.middlewares import DedupMiddleware
+from webbot.utils import utils
+import random
+import sys
+import time
+
+class FakePipeline(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def zscore(self, key, member):
+        self.ops.append(member)
+
+    def execute(self):
+        time.sleep(self.db.rtt)
+        self.db.trips += 1
+        return [self.db.score(m) for m in self.ops]
+
+class FakeRedis(object):
+
+    def __init__(self, members, rtt):
+        self.members = set(members)
+        self.rtt = rtt
+        self.trips = 0
+
+    def score(self, member):
+        return 1.0 if member in self.members else None
+
+    def zrank(self, key, member):
+        time.sleep(self.rtt)
+        self.trips += 1
+        return 0 if member in self.members else None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakeCrawler(object):
+
+    def __init__(self):
+        self.settings = get_project_settings()
+        self.stats = MemoryStatsCollector(self)
+        self.engine = self
+        self.crawled = []
+
+    def crawl(self, request, spider):
+        self.crawled.append(request)
+
+def make_urls(n):
+    # links repeat across pages, a third of them were crawled before
+    pool = ['http://www.example.com/item/{}'.format(i) for i in xrange(n//4)]
+    seen = [utils.hash_url(u) for u in pool[::3]]
+    return [random.choice(pool) for i in xrange(n)], seen
+
+def legacy(urls, db):
+    passed = 0
+    start = time.time()
+    for url in urls:
+        if db.zrank('urlset', utils.hash_url(url)) is None:
+            passed += 1
+    elapsed = time.time()-start
+    return passed, elapsed, elapsed
+
+def twotier(urls, db):
+    crawler = FakeCrawler()
+    spider = Spider('bench')
+    mw = DedupMiddleware(crawler)
+    mw.db = db
+    mw.setup(spider)
+    result = {}
+
+    def feed(i=0):
+        # one page of links per reactor turn
+        for url in urls[i:i+50]:
+            t = time.time()
+            try:
+                mw.process_request(Request(url), spider)
+                result['passed'] += 1
+            except IgnoreRequest:
+                pass
+            result['busy'] += time.time()-t
+        if i+50<len(urls):
+            reactor.callLater(0, feed, i+50)
+        else:
+            wait()
+
+    def wait():
+        if mw.waiting:
+            reactor.callLater(0.001, wait)
+        else:
+            result['elapsed'] = time.time()-result['start']
+            reactor.stop()
+
+    result.update(start=time.time(), busy=0, passed=0)
+    reactor.callWhenRunning(feed)
+    reactor.run()
+    mw.spider_closed(spider, 'finished')
+    stats = crawler.stats.get_stats(spider)
+    print '    {}'.format(', '.join('{}={}'.format(k, v) for k,v in sorted(stats.iteritems()) if k.startswith('dedup/')))
+    return result['passed']+len(crawler.crawled), result['elapsed'], result['busy']
+
+if __name__=='__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv)>1 else 20000
+    rtt = float(sys.argv[2])/1000 if len(sys.argv)>2 else 0.5/1000
+
+    random.seed(0)
+    urls, seen = make_urls(n)
+
+    for name, func in [('zrank', legacy), ('two-tier', twotier)]:
+        db = FakeRedis(seen, rtt)
+        passed, elapsed, busy = func(urls, db)
+        print '{:<10} {:>8} requests {:>8} passed {:>8} round trips {:>8.3f}s total {:>8.3f}s reactor'.format(
+            name, n, passed, db.trips, elapsed, busy)
+
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: memory/throughput of keyword dedup(set vs. bloom)
+#
+#   $ PYTHONPATH=. python scripts/bench-dedup.py [keywords ...]
+#
+# each run uses its own process(peak rss is per process), half of the
+# keywords are excluded(excfile), the other half are included twice.
+#
+
+from webbot.utils import utils
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+def make_files(n):
+    exc = tempfile.mkstemp(suffix='.exc')
+    inc = tempfile.mkstemp(suffix='.inc')
+    with os.fdopen(exc[0], 'w') as f:
+        for i in xrange(0, n, 2):
+            f.write('keyword-{:09d}\n'.format(i))
+    with os.fdopen(inc[0], 'w') as f:
+        for i in xrange(n):
+            f.write('keyword-{:09d}\n'.format(i))
+        for i in xrange(1, n, 2):
+            f.write('keyword-{:09d}\n'.format(i))
+    return exc[1], inc[1]
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def run(mode, n, exc, inc):
+    kw_obj = {'excfile': exc, 'file': inc, 'dedup': {'type': mode, 'capacity': n, 'error': 0.001}}
+    base = maxrss()
+    start = time.time()
+    cnt = 0
+    for kw in utils.load_keywords(kw_obj):
+        cnt += 1
+    elapsed = time.time()-start
+    lines = n + n//2 + n//2
+    print '{:<6} {:>10} keywords {:>10} unique {:>8.2f}s {:>10.1f} lines/sec {:>10.1f} MB(growth)'.format(
+        mode, n, cnt, elapsed, lines/elapsed, maxrss()-base)
+
+if __name__=='__main__':
+
+    if len(sys.argv)>1 and sys.argv[1] in ['set', 'bloom']:
+        run(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4])
+        sys.exit()
+
+    for n in [int(i) for i in sys.argv[1:]] or [1000000, 10000000]:
+        exc, inc = make_files(n)
+        try:
+            for mode in ['set', 'bloom']:
+                subprocess.check_call([sys.executable, __file__, mode, str(n), exc, inc])
+        finally:
+            os.remove(exc)
+            os.remove(inc)
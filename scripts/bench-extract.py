@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: ItemLoader extraction vs. compiled extraction plan
+#
+#   $ PYTHONPATH=. python scripts/bench-extract.py [rows] [pages]
+#
+
+from scrapy.contrib.loader import ItemLoader
+from scrapy.http import HtmlResponse, Request
+from scrapy.item import Item, Field
+from scrapy.selector import Selector
+from webbot.utils import extractor, parser, utils
+import sys
+import time
+
+ROW = u'''
+<tr class="item">
+  <td class="title"><a href="/subject/{0}/">电影标题 {0}</a></td>
+  <td class="rate"><span>8.{1}</span> (12,3{1}5人评价)</td>
+  <td class="date">2014-0{2}-1{1} 12:3{1}</td>
+  <td class="desc"><p>  简介 {0} <b>加粗</b>   文本  </p></td>
+  <td class="tags"><i>剧情</i><i>爱情</i><i>{0}</i></td>
+  <td class="img"><img src="http://img.example.com/{0}.jpg"/></td>
+</tr>'''
+
+FIELDS = {
+    'url':     {'value': '${URL}'},
+    'site':    {'value': '${SITE}'},
+    'title':   {'xpath': './/td[@class="title"]/a/text()', 'parse': ['text', 'norm']},
+    'link':    {'xpath': './/td[@class="title"]/a/@href'},
+    'rate':    {'css': 'td.rate span::text', 'parse': 'float'},
+    'votes':   {'xpath': './/td[@class="rate"]/text()', 'regex': r'([0-9,]+)', 'parse': 'int'},
+    'date':    {'xpath': './/td[@class="date"]/text()', 'parse': {'type': 'date', 'tz': '+08:00'}},
+    'desc':    {'xpath': './/td[@class="desc"]', 'parse': ['text', 'norm']},
+    'tags':    {'xpath': './/td[@class="tags"]/i/text()', 'multi': True},
+    'image':   {'xpath': './/td[@class="img"]/img/@src', 'parse': 'trim'},
+    'missing': {'xpath': './/td[@class="nothing"]/text()', 'opt': True},
+    'flag':    {'xpath': './/td[@class="nothing"]/text()', 'default': '02'},
+}
+
+def make_response(rows):
+    body = u'<html><body><table>{}</table></body></html>'.format(
+        u''.join(ROW.format(i, i%10, i%9+1) for i in xrange(rows)))
+    url = 'http://movie.example.com/chart'
+    return HtmlResponse(url=url, body=body.encode('utf-8'), encoding='utf-8', request=Request(url))
+
+def legacy(response, macro, fields, loop):
+    meta = response.meta
+    hxs = Selector(response)
+    for e in hxs.xpath(loop):
+        loader = ItemLoader(item=Item(), selector=e)
+        for k,v in fields.iteritems():
+            if 'value' in v:
+                get_v_x, v_x = loader.get_value, v.get('value')
+            elif 'css' in v:
+                get_v_x, v_x = loader.get_css, v.get('css')
+            else:
+                get_v_x, v_x = loader.get_xpath, v.get('xpath')
+            val = get_v_x(macro.expand(v_x, meta), parser.make_parser(v.get('parse', {})), re=v.get('regex'))
+            if not val and 'default' in v:
+                val = [macro.expand(v.get('default'), meta)]
+            if not (val or v.get('multi') or v.get('opt')):
+                break
+            loader.add_value(k, val)
+        else:
+            yield loader.load_item()
+
+def compiled(response, macro, plan, loop):
+    return plan.extract(Selector(response).xpath(loop), response.meta)
+
+def bench(name, func, response, pages):
+    start = time.time()
+    cnt = 0
+    for i in xrange(pages):
+        for item in func(response):
+            cnt += 1
+    elapsed = time.time()-start
+    print '{:<10} {:>8} items {:>8.3f}s {:>10.1f} items/sec'.format(name, cnt, elapsed, cnt/elapsed)
+    return cnt/elapsed
+
+if __name__=='__main__':
+
+    rows = int(sys.argv[1]) if len(sys.argv)>1 else 50
+    pages = int(sys.argv[2]) if len(sys.argv)>2 else 100
+    loop = '//tr[@class="item"]'
+
+    for k,v in FIELDS.iteritems():
+        Item.fields[k] = Field(v)
+
+    response = make_response(rows)
+    macro = utils.MacroExpander({'SITE': u'豆瓣电影'})
+    macro.update({'URL': response.url, 'keyword': ''})
+    plan = extractor.ExtractionPlan(FIELDS, macro)
+
+    old = [dict(i) for i in legacy(response, macro, FIELDS, loop)]
+    new = [dict(i) for i in compiled(response, macro, plan, loop)]
+    assert old==new, 'items mismatch'
+
+    a = bench('loader', lambda r: legacy(r, macro, FIELDS, loop), response, pages)
+    b = bench('plan', lambda r: compiled(r, macro, plan, loop), response, pages)
+    print 'speedup: {:.2f}x'.format(b/a)
+
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: jsonpath.jsonpath vs. compiled webbot.utils.jpath
+#
+#   $ PYTHONPATH=. python scripts/bench-jpath.py [loops]
+#
+
+from webbot.utils import jpath
+import jsonpath
+import sys
+import time
+
+DOC = {
+    'status': 0,
+    'data': [
+        {
+            'id': i,
+            'title': u'标题 %d' % i,
+            'price': i*1.5,
+            'tags': [u'a', u'b', u'c'][:i%3+1],
+            'author': {'name': u'作者 %d' % i, 'uid': 1000+i},
+            'comments': [{'uid': j, 'text': u'评论 %d' % j} for j in xrange(i%4)],
+        } for i in xrange(50)
+    ],
+    'page': {'current': 1, 'total': 20},
+}
+
+EXPRS = [
+    '$[]',
+    '$.data[*]',
+    '$.data[0].title',
+    '$.data[*].author.name',
+    '$..uid',
+    '$.data[2:10:2].id',
+    '$.data[-3:].id',
+    '$.data[1,3,5].title',
+    '$.data[?(@.price > 30)].id',
+    '$.data[?(@.author.uid == 1007)].title',
+    '$.data[?(@.comments)].id',
+    '$.data[?(@.tags.length > 2)].id',
+    '$.data[(@.length-1)].id',
+    "$['page']['total']",
+    '$.page.*',
+    '$.nothing',
+    '$',
+]
+
+def bench(name, func, loops):
+    start = time.time()
+    for i in xrange(loops):
+        for e in EXPRS:
+            func(DOC, e)
+    elapsed = time.time()-start
+    calls = loops*len(EXPRS)
+    print '{:<10} {:>8} calls {:>8.3f}s {:>10.1f} calls/sec'.format(name, calls, elapsed, calls/elapsed)
+    return calls/elapsed
+
+if __name__=='__main__':
+
+    loops = int(sys.argv[1]) if len(sys.argv)>1 else 200
+
+    for e in EXPRS:
+        assert jpath.jsonpath(DOC, e)==jsonpath.jsonpath(DOC, e), 'mismatch: {}'.format(e)
+
+    a = bench('jsonpath', jsonpath.jsonpath, loops)
+    b = bench('jpath', jpath.jsonpath, loops)
+    print 'speedup: {:.2f}x'.format(b/a)
+
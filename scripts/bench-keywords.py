@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: memory of keyword-driven url generation
+#
+#   $ PYTHONPATH=. python scripts/bench-keywords.py [keywords]
+#
+# each mode runs in its own process(peak rss is per process):
+#
+#   bindings: url=>keyword kept in a global map(old MacroExpander.bind/query)
+#   meta:     keyword carried with the url(request meta)
+#
+
+from webbot.utils import utils
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+def make_file(n):
+    fd, fn = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        for i in xrange(n):
+            f.write('keyword-{:08d}\tcolumn-{}\n'.format(i, i%100))
+    return fn
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def run(mode, fn):
+    conf = {
+        'base': u'http://www.example.com/search?rn=10',
+        'keywords': {'name': u'q', 'file': fn, 'col': 1, 'sep': '\t'},
+    }
+    macro = utils.MacroExpander({})
+    bindings = {}
+    base = maxrss()
+    start = time.time()
+    cnt = 0
+    for url, kw in utils.generate_urls(conf, macro):
+        if mode=='bindings':
+            bindings[url] = kw
+            kw = bindings.get(url, '')
+        cnt += 1
+    elapsed = time.time()-start
+    print '{:<10} {:>10} urls {:>8.2f}s {:>10.1f} MB(peak) {:>10.1f} MB(growth)'.format(mode, cnt, elapsed, maxrss(), maxrss()-base)
+
+if __name__=='__main__':
+
+    if len(sys.argv)>2:
+        run(sys.argv[1], sys.argv[2])
+        sys.exit()
+
+    n = int(sys.argv[1]) if len(sys.argv)>1 else 2000000
+    fn = make_file(n)
+    try:
+        for mode in ['bindings', 'meta']:
+            subprocess.check_call([sys.executable, __file__, mode, fn])
+    finally:
+        os.remove(fn)
+
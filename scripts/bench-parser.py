@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: field parsers(webbot.utils.parser) on a generated field corpus
+#
+#   $ PYTHONPATH=. python scripts/bench-parser.py [-n values] [-b base] [name ...]
+#
+# each parser is built once(make_parser) and called once per extracted
+# field value, as ExtractionPlan does. "batch" is the same corpus split in
+# pages of 100 rows(BaseParser.batch, setting `batch_parse`). "digest" is a
+# hash of the outputs, it must not change between versions of the parsers,
+# and is computed over both runs(the outputs must be identical).
+#
+# -b compares with the per-value parsers of another revision(e.g. before
+# they were compiled once), run in a child process with PYTHONPATH=base:
+#
+#   $ git worktree add /tmp/base 93017a2
+#   $ PYTHONPATH=. python scripts/bench-parser.py -b /tmp/base
+#
+# "base" is the us/value of that revision, "speedup" base/us of this one,
+# the digest is marked "!=" when the outputs differ.
+#
+
+from datetime import datetime, timedelta
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+TITLE = u'<a href="/subject/{0}/">  电影标题&nbsp;{0} &amp; 续集  </a>'
+DESC = u'''<div class="desc"><script>var x = {0};</script><style>p {{color: red}}</style>
+<p>  简介 {0}  <b>加粗</b>   文本 <a href="/tag/{1}" onclick="go()">标签{1}</a></p>
+<p class="ad">广告 {1}</p><p>第二段   内容   {0}</p></div>'''
+COUNT = [u'12,3{0}5人评价', u'阅读 ({0})', u'-{0}.5 分', u'评论：1,0{0}0']
+DATE = [u'2014-03-1{0} 12:3{0}', u'{0}分钟前', u'昨天 10:2{0}', u'2014年3月1{0}日']
+SOURCE = [u'来源：新华网', u'来源: 人民网', u'本站原创', u'转载自 新浪新闻', u'unknown-{0}']
+
+CASES = [
+    ('grep',    {'type': 'grep', 'pattern': r'\d+'},               lambda i: COUNT[i%4].format(i%10)),
+    ('int',     'int',                                              lambda i: COUNT[i%4].format(i%10)),
+    ('float',   'float',                                            lambda i: COUNT[i%4].format(i%10)),
+    ('sub',     {'type': 'sub', 'from': r'\s+', 'to': u' '},       lambda i: DESC.format(i, i%7)),
+    ('norm',    'norm',                                             lambda i: DESC.format(i, i%7)),
+    ('text',    'text',                                             lambda i: TITLE.format(i)),
+    ('unesc',   'unesc',                                            lambda i: TITLE.format(i)),
+    ('clean',   'clean',                                            lambda i: DESC.format(i, i%7)),
+    ('xpath',   {'type': 'xpath', 'query': '//p[not(@class)]//text()'}, lambda i: DESC.format(i, i%7)),
+    ('purge',   {'type': 'purge', 'query': '//p[@class="ad"]'},    lambda i: DESC.format(i, i%7)),
+    ('map',     {'type': 'map', 'map': {u'新华': u'xinhua', u'人民': u'people', u'新浪': u'sina', u'原创': u'self'},
+                 'default': u'other'},                              lambda i: SOURCE[i%5].format(i)),
+    ('filter',  {'type': 'filter', '$gte': 100, '$lt': 5000},      lambda i: i%8000),
+    ('regex',   {'type': 'filter', '$regex': u'^[0-9]+分钟'},      lambda i: DATE[i%4].format(i%10)),
+    ('delta',   {'type': 'filter', 'delta': 3600},                 lambda i: datetime(2014, 3, 1)+timedelta(minutes=i)),
+    ('string',  {'type': 'filter', 'string': 'startswith', 'args': [u'来源']}, lambda i: SOURCE[i%5].format(i)),
+    ('date',    'cst',                                              lambda i: DATE[i%2*3].format(i%10)),
+    ('join',    {'type': 'join', 'sep': u'|'},                     lambda i: [u'剧情', u'爱情', unicode(i)]),
+    ('pipe',    ['text', 'norm', {'type': 'sub', 'from': u'^(简介)', 'to': u'[\\1]'}], lambda i: DESC.format(i, i%7)),
+]
+
+def digest(values):
+    md5 = hashlib.md5()
+    for v in values:
+        md5.update(repr(v))
+    return md5.hexdigest()[:8]
+
+def per_value(spec, make, n):
+    r"""(us/value, outputs) of the parser called once per value"""
+    from webbot.utils import parser
+    p = parser.make_parser(spec)
+    values = [[make(i)] for i in xrange(n)]
+    p(values[0])
+    start = time.time()
+    out = [p(v) for v in values]
+    return (time.time()-start)*1e6/n, out
+
+def batched(spec, make, n, rows=100):
+    r"""(values/s, outputs) of the parser over pages of rows(BaseParser.batch)"""
+    from webbot.utils import parser
+    p = parser.make_parser(spec)
+    values = [[make(i)] for i in xrange(n)]
+    start = time.time()
+    out = []
+    for i in xrange(0, n, rows):
+        out.extend(p.batch(values[i:i+rows]))
+    return n/(time.time()-start), out
+
+def baseline(base, n, names):
+    r"""{name: [us/value, digest]} of the parsers in the base tree(child process)"""
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(base))
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', '-n', str(n)]+names
+    try:
+        return json.loads(subprocess.check_output(cmd, env=env).strip().splitlines()[-1])
+    except (subprocess.CalledProcessError, ValueError):
+        print >>sys.stderr, 'cannot run the parsers of <{}>'.format(base)
+        return {}
+
+def child(n, names):
+    results = {}
+    for name, spec, make in CASES:
+        if not names or name in names:
+            try:
+                us, out = per_value(spec, make, n)
+                results[name] = [us, digest(out)]
+            except Exception:
+                pass
+    print json.dumps(results)
+
+def run(name, spec, make, n, base=None):
+    us, out = per_value(spec, make, n)
+    rate, batch = batched(spec, make, n)
+    dg = digest(out) if repr(out)==repr(batch) else 'MISMATCH'
+    if base is None:
+        print '{:<8} {:>10.1f} us/value {:>10.0f} values/s {:>10.0f} batch/s   digest={}'.format(
+            name, us, 1e6/us, rate, dg)
+        return
+    old = base.get(name)
+    print '{:<8} {:>10} {:>10.1f} {:>8} {:>10.0f} batch/s   digest={}{}'.format(
+        name, '{:.1f}'.format(old[0]) if old else '-', us, '{:.2f}x'.format(old[0]/us) if old else '-',
+        rate, dg, '' if not old or old[1]==dg else ' != '+old[1])
+
+if __name__=='__main__':
+
+    ap = argparse.ArgumentParser(description='benchmark the field parsers on a generated corpus')
+    ap.add_argument('names', nargs='*', metavar='name', help='cases to run(default: all)')
+    ap.add_argument('-n', '--values', type=int, default=5000, help='values per case')
+    ap.add_argument('-b', '--base', help='tree of another revision to compare with(per value)')
+    ap.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    random.seed(0)
+    if args.child:
+        child(args.values, args.names)
+        sys.exit(0)
+
+    base = None
+    if args.base:
+        base = baseline(args.base, args.values, args.names)
+        print '{:<8} {:>10} {:>10} {:>8}'.format('', 'base', 'us/value', 'speedup')
+    for name, spec, make in CASES:
+        if not args.names or name in args.names:
+            run(name, spec, make, args.values, base)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# benchmark: extraction layer over recorded responses(offline)
+#
+#   $ PYTHONPATH=. python scripts/bench.py [-t seconds] [-o results.json] [-c baseline.json] [suite ...]
+#
+# suites(each one runs in its own process, so maxrss is per suite):
+#
+#   html        WebbotSpider.parse_html_item on html pages marked "extract"
+#   html-batch  same, with the `batch_parse` setting
+#   json        WebbotSpider.parse_json_item on json pages marked "extract"
+#   follow      WebbotSpider._requests_to_follow on pages marked "follow"
+#   macro       MacroExpander.expand on templates(typical ones + those of the configs)
+#   parser      field parsers of the configs on the raw field values of the pages
+#   date        parse_date on the raw values of date fields(memo cleared every round)
+#
+# pages and their configs are listed in examples/fixtures/index.json,
+# spiders are built from the configs as `scrapy crawl webbot` does. Each
+# suite runs rounds over its corpus for at least -t seconds, after one
+# warm-up round, rates are those of the median round. "objects" is the
+# growth of gc tracked objects over the timed rounds(python 2 has no
+# tracemalloc), "maxrss" is the peak rss of the suite process, "+rss" its
+# growth after setup. Nothing touches the network.
+#
+# -o writes the results(with the commit of the webbot package measured)
+# as json, -c compares them with a previous file. The fixtures always come
+# from this tree, so another revision is measured through PYTHONPATH:
+#
+#   $ git worktree add /tmp/base HEAD~1
+#   $ PYTHONPATH=/tmp/base python scripts/bench.py -o /tmp/base.json
+#   $ PYTHONPATH=. python scripts/bench.py -c /tmp/base.json
+#
+
+from collections import OrderedDict
+from datetime import datetime
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'examples', 'fixtures')
+SUITES = ['html', 'html-batch', 'json', 'follow', 'macro', 'parser', 'date']
+
+TEMPLATES = [
+    u'${URL}',
+    u'${SITE}',
+    u'http://www.example.com/search?q=${keyword}&page=1',
+    u'http://www.example.com/s?wd=${COL1}&city=${COL2}',
+    u'http://www.example.com/list?date=${TODAY}&t=${UNOW}',
+    u'http://www.example.com/archive/${YEAR}/${MONTH}/${DAY}/',
+    u'${FOO}-${TODAY}',
+    u'no macros at all',
+]
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def load_index():
+    with open(os.path.join(FIXTURES, 'index.json')) as f:
+        return json.load(f)['pages']
+
+_spiders = {}
+
+def get_spider(path):
+    r"""spider of config path(built once, offline)"""
+
+    spider = _spiders.get(path)
+    if spider is None:
+        from scrapy.crawler import Crawler
+        from scrapy.utils.project import get_project_settings
+        from webbot.spiders.webbot_spider import WebbotSpider
+        os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'webbot.settings')
+        settings = get_project_settings()
+        settings.set('config', os.path.join(ROOT, path), priority='cmdline')
+        spider = _spiders[path] = WebbotSpider()
+        spider.set_crawler(Crawler(settings))
+    return spider
+
+def make_response(page):
+    from scrapy.http import HtmlResponse, Request, TextResponse
+    with open(os.path.join(FIXTURES, page['file'])) as f:
+        body = f.read()
+    cls = TextResponse if page['file'].endswith('.json') else HtmlResponse
+    return cls(url=page['url'], body=body, encoding='utf-8', request=Request(page['url']))
+
+def pages_of(kind, html=None):
+    r"""(spider, page) of pages marked kind"""
+
+    jobs = []
+    for page in load_index():
+        if not page.get(kind):
+            continue
+        spider = get_spider(page['config'])
+        if html is not None and (spider.parse_item==spider.parse_html_item)!=html:
+            continue
+        jobs.append((spider, page))
+    return jobs
+
+def raw_values(spider, page):
+    r"""(FieldPlan, raw value) of every field and loop element of page"""
+
+    from webbot.utils import docs, jpath
+    response = make_response(page)
+    spider.macro.update({'URL':response.url, 'keyword':''})
+    plan = spider.get_plan(spider.fields)
+    values = []
+    if spider.parse_item==spider.parse_json_item:
+        obj = json.loads(response.body)
+        for e in jpath.jsonpath(obj, spider.loop or '$[]') or []:
+            for f in plan.fields:
+                if f.kind=='jpath':
+                    values.append((f, f.jpath(e) if f.jpath else jpath.jsonpath(e, f.expr)))
+    else:
+        for e in docs.get(response).selector.xpath(spider.loop or '(//*)[1]'):
+            for f in plan.fields:
+                if f.kind in ['value', 'css', 'xpath']:
+                    values.append((f, f.raw(e, spider.macro, response.meta)))
+        docs.release(response)
+    return [(f, v) for f,v in values if v not in [None, False]]
+
+def suite_items(batch=False, html=True):
+
+    from webbot.utils import docs
+    jobs = pages_of('extract', html=html)
+
+    def run():
+        items = 0
+        for spider, page in jobs:
+            spider.batch_parse = batch
+            response = make_response(page)
+            for item in spider.parse_item(response, spider.loop, spider.fields):
+                items += 1
+            docs.release(response)
+        return len(jobs), items
+
+    return run
+
+def suite_follow():
+
+    from webbot.utils import docs
+    jobs = pages_of('follow', html=True)
+
+    def run():
+        requests = 0
+        for spider, page in jobs:
+            response = make_response(page)
+            for request in spider._requests_to_follow(response):
+                requests += 1
+            docs.release(response)
+        return len(jobs), requests
+
+    return run
+
+def suite_macro():
+
+    templates = list(TEMPLATES)
+    macros = []
+    for spider, page in pages_of('extract')+pages_of('follow'):
+        if spider.macro not in macros:
+            macros.append(spider.macro)
+        for f in spider.plan.fields:
+            for v in [f.expr, f.default]:
+                if isinstance(v, basestring) and '$' in v and v not in templates:
+                    templates.append(v)
+    for m in macros:
+        m.update({'URL':'http://www.example.com/', 'keyword':u'关键词\t北京', 'sep':'\t'})
+    meta = {'FOO':'bar', 'PAGE':'2', 'keyword':u'关键词'}
+
+    def run():
+        for m in macros:
+            for t in templates:
+                m.expand(t, meta)
+        return 0, len(macros)*len(templates)
+
+    return run
+
+def suite_parser():
+
+    values = []
+    for spider, page in pages_of('extract'):
+        values.extend((f.parser, v) for f,v in raw_values(spider, page) if f.inf.get('parse'))
+
+    def run():
+        for parser, v in values:
+            parser(v)
+        return 0, len(values)
+
+    return run
+
+def suite_date():
+
+    from webbot.utils import dateparser, parser
+    values = []
+    for spider, page in pages_of('extract'):
+        for f,v in raw_values(spider, page):
+            ps = f.parser.parsers if isinstance(f.parser, parser.PipeParser) else [f.parser]
+            for p in ps:
+                if isinstance(p, parser.DateParser):
+                    values.extend((x, p.fmt, p.tz) for x in v if isinstance(x, basestring))
+    memo = getattr(dateparser, '_memo', None)
+
+    def run():
+        if memo is not None:
+            memo.clear()
+        for x, fmt, tz in values:
+            dateparser.parse_date(x, fmt, tz)
+        return 0, len(values)
+
+    return run
+
+def measure(name, seconds):
+    r"""run suite name for seconds => result(dict)"""
+
+    run = {
+        'html':       lambda: suite_items(),
+        'html-batch': lambda: suite_items(batch=True),
+        'json':       lambda: suite_items(html=False),
+        'follow':     suite_follow,
+        'macro':      suite_macro,
+        'parser':     suite_parser,
+        'date':       suite_date,
+    }[name]()
+
+    pages, items = run()
+    gc.collect()
+    objects = len(gc.get_objects())
+    base = maxrss()
+    times = []
+    start = time.time()
+    while time.time()-start<seconds:
+        t = time.time()
+        run()
+        times.append(time.time()-t)
+    gc.collect()
+
+    # every round does the same work: rates of the median round(robust to noise)
+    median = sorted(times)[len(times)//2]
+
+    return OrderedDict([
+        ('rounds', len(times)),
+        ('pages', pages),
+        ('items', items),
+        ('round_ms', round(median*1000, 3)),
+        ('pages_per_sec', round(pages/median, 1) if pages else None),
+        ('items_per_sec', round(items/median, 1)),
+        ('objects', len(gc.get_objects())-objects),
+        ('maxrss_kb', maxrss()),
+        ('rss_growth_kb', maxrss()-base),
+    ])
+
+def commit():
+    r"""revision of the webbot package being measured"""
+
+    try:
+        import webbot
+        path = os.path.dirname(os.path.abspath(webbot.__file__))
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=path, stderr=null).strip()
+    except Exception:
+        return None
+
+def fmt(v, spec='{:>10.1f}'):
+    return '{:>10}'.format('-') if v is None else spec.format(v)
+
+def report(results):
+    print '{:<12} {:>10} {:>10} {:>8} {:>10} {:>10}'.format('suite', 'pages/s', 'items/s', 'objects', 'maxrss', '+rss')
+    for name, r in results.iteritems():
+        print '{:<12} {} {} {:>8} {:>9.1f}M {:>9.1f}M'.format(name, fmt(r['pages_per_sec']), fmt(r['items_per_sec']),
+            r['objects'], r['maxrss_kb']/1024.0, r['rss_growth_kb']/1024.0)
+
+def compare(base, results):
+    print
+    print 'vs. {} ({})'.format(base.get('commit'), base.get('time'))
+    print '{:<12} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}'.format('suite', 'pages/s', 'base', 'change', 'items/s', 'base', 'change')
+    for name, r in results.iteritems():
+        b = base['results'].get(name)
+        if not b:
+            continue
+        cols = []
+        for k in ['pages_per_sec', 'items_per_sec']:
+            change = '{:>+7.1f}%'.format((r[k]/b[k]-1)*100) if r[k] and b[k] else '{:>8}'.format('-')
+            cols.append('{} {} {}'.format(fmt(r[k]), fmt(b[k]), change))
+        print '{:<12} {}'.format(name, ' '.join(cols))
+
+if __name__=='__main__':
+
+    ap = argparse.ArgumentParser(description='benchmark the extraction layer over examples/fixtures(offline)')
+    ap.add_argument('suites', nargs='*', metavar='suite', help='one of: {}(default: all)'.format(', '.join(SUITES)))
+    ap.add_argument('-t', '--seconds', type=float, default=2.0, help='minimum run time per suite')
+    ap.add_argument('-o', '--output', help='write results to this json file')
+    ap.add_argument('-c', '--compare', help='compare with results of a previous run(json file)')
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print json.dumps(measure(args.child, args.seconds))
+        sys.exit(0)
+
+    for name in args.suites:
+        if name not in SUITES:
+            ap.error('unknown suite <{}>'.format(name))
+
+    results = OrderedDict()
+    for name in [k for k in SUITES if k in args.suites] or SUITES:
+        try:
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', name, '-t', str(args.seconds)])
+        except subprocess.CalledProcessError:
+            print >>sys.stderr, 'suite <{}> failed, skipped'.format(name)
+            continue
+        results[name] = json.loads(out.strip().splitlines()[-1], object_pairs_hook=OrderedDict)
+
+    report(results)
+
+    doc = OrderedDict([
+        ('commit', commit()),
+        ('python', platform.python_version()),
+        ('time', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')),
+        ('seconds', args.seconds),
+        ('results', results),
+    ])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2, separators=(',', ': '))
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
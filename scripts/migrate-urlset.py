@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# migrate urlset from 40-char hex sha1 members to compact fingerprints
+#
+#   $ PYTHONPATH=. python scripts/migrate-urlset.py -r redis://localhost:6379/0 --fp raw8 --buckets 1048576
+#   $ PYTHONPATH=. python scripts/migrate-urlset.py -r redis://localhost:6379/15 --report
+#
+# scores(crawl time) are kept, or taken from another sorted set with
+# --scores(e.g. urlset2 of the old layout, members missing there get the
+# current time). Without buckets the new set is written to <key>.new and
+# renamed over <key> when done(--replace). Use the same dedup_fp/
+# dedup_buckets settings in the spider config afterwards.
+#
+# --report writes 1M random fingerprints per format into scratch keys of
+# the given(empty!) database, prints memory per million urls and cleans up.
+#
+
+from datetime import datetime
+from webbot.utils import utils
+import argparse
+import hashlib
+import os
+import redis
+import time
+
+def migrate(db, src, fpr, chunk, replace, scores=None):
+
+    dst = fpr.name
+    total = db.zcard(src)
+    cur = cnt = 0
+    while True:
+        cur, items = db.zscan(src, cur, count=chunk)
+        if items and scores:
+            pipe = db.pipeline(transaction=False)
+            for member, score in items:
+                pipe.zscore(scores, member)
+            now = int(time.time())
+            items = [(m, now if s is None else s) for (m, _), s in zip(items, pipe.execute())]
+        if items:
+            groups = {}
+            for member, score in items:
+                fp = fpr.convert(member)
+                groups.setdefault(fpr.key(fp), []).extend([score, fp])
+            pipe = db.pipeline(transaction=False)
+            for key, args in groups.iteritems():
+                pipe.execute_command('ZADD', key, *args)
+            pipe.execute()
+            cnt += len(items)
+            print datetime.now(), 'migrated', cnt, '/', total
+        if cur==0:
+            break
+
+    if replace and not fpr.buckets:
+        db.rename(dst, src)
+        print datetime.now(), 'renamed', dst, '=>', src
+    return cnt
+
+def used_memory(db):
+
+    return db.info('memory')['used_memory']
+
+def fill(db, fpr, n, chunk=10000):
+
+    now = int(time.time())
+    for i in xrange(0, n, chunk):
+        groups = {}
+        for j in xrange(i, min(n, i+chunk)):
+            hexfp = hashlib.sha1(str(j)).hexdigest()
+            fp = fpr.convert(hexfp)
+            groups.setdefault(fpr.key(fp), []).extend([now-j%(7*24*3600), fp])
+        pipe = db.pipeline(transaction=False)
+        for key, args in groups.iteritems():
+            pipe.execute_command('ZADD', key, *args)
+        pipe.execute()
+
+def clear(db, fpr):
+
+    keys = [fpr.name] + list(db.scan_iter(match='{}:*'.format(fpr.name), count=10000))
+    for i in xrange(0, len(keys), 1000):
+        db.delete(*keys[i:i+1000])
+
+def report(db, n):
+
+    formats = [
+        ('hex', 0), ('raw16', 0), ('raw8', 0),
+        ('raw16', n//100), ('raw8', n//100),
+    ]
+    print '{:<8} {:>10} {:>14} {:>16}'.format('format', 'buckets', 'bytes/url', 'MB/million urls')
+    for fmt, buckets in formats:
+        fpr = utils.UrlFingerprint(fmt, buckets, key='urlset.report.{}'.format(os.getpid()))
+        base = used_memory(db)
+        fill(db, fpr, n)
+        used = used_memory(db)-base
+        clear(db, fpr)
+        print '{:<8} {:>10} {:>14.1f} {:>16.1f}'.format(fmt, buckets, 1.0*used/n, used*1e6/n/1024/1024)
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='migrate urlset to compact fingerprints')
+    parser.add_argument('-r', '--redis', default='redis://localhost:6379/0', help='redis uri')
+    parser.add_argument('-k', '--key', default='urlset', help='source sorted set(hex members)')
+    parser.add_argument('--fp', default='raw8', choices=['hex', 'raw16', 'raw8'], help='fingerprint format')
+    parser.add_argument('--buckets', type=int, default=0, help='spread over <key>:0 .. <key>:N-1(0: single set)')
+    parser.add_argument('--chunk', type=int, default=10000, help='members per ZSCAN round')
+    parser.add_argument('--replace', action='store_true', help='rename <key>.new over <key> when done')
+    parser.add_argument('--scores', metavar='KEY', help='take the scores(crawl time) from this sorted set, e.g. urlset2')
+    parser.add_argument('--report', action='store_true', help='print memory per million urls and exit')
+    parser.add_argument('-n', type=int, default=1000000, help='urls used by --report')
+    args = parser.parse_args()
+
+    db = redis.StrictRedis.from_url(args.redis)
+
+    if args.report:
+        report(db, args.n)
+    else:
+        name = args.key if args.buckets else args.key+'.new'
+        fpr = utils.UrlFingerprint(args.fp, args.buckets, key=name)
+        migrate(db, args.key, fpr, args.chunk, args.replace, args.scores)
+
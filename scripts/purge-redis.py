@@ -1,36 +1,124 @@
 #!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# expire old url hashes from urlset(score: crawl time, written by DedupMiddleware)
+#
+#   $ python scripts/purge-redis.py -r redis://localhost:6379/0 -d 7
+#
+# ZREMRANGEBYSCORE removes at most --chunk members per call, so the redis
+# server is never blocked by one huge deletion. With --buckets every
+# <key>:N set(dedup_buckets) is purged. A set whose scores are not epoch
+# timestamps(urlset written by something else) is skipped with a warning,
+# the other sets are still purged. scripts/migrate-urlset.py --scores
+# rewrites it with the crawl times of another set(e.g. urlset2).
+#
+# old layout: if <key>2(urlset2, score: crawl time) exists, its expired
+# members are removed from urlset and urlset2 and their per-hash keys are
+# deleted, as the old version of this script did. Skip it with --no-legacy.
+#
 
+from datetime import datetime
+import argparse
 import redis
+import sys
 import time
-from datetime import datetime, timedelta
 
-db = redis.StrictRedis(host='192.168.94.3')
-now = datetime.now()
-ago = now - timedelta(days=7)
+def purge(db, key, cutoff, chunk, dry_run=False):
 
-tot = db.zcard('urlset2')
+    total = 0
+    while True:
+        # score of the chunk-th expired member bounds this round
+        last = db.zrangebyscore(key, '-inf', cutoff, start=chunk-1, num=1, withscores=True)
+        bound = last[0][1] if last else cutoff
+        if dry_run:
+            count = db.zcount(key, '-inf', cutoff)
+            total += count
+            break
+        count = db.zremrangebyscore(key, '-inf', bound)
+        total += count
+        if count>=chunk:
+            print datetime.now(), key, 'removed', total
+        if not last or count==0:
+            break
+    return total
 
-cur = idx = cnt = 0
+def bad_scores(db, key, now):
+    r"""(min, max) score of key if they do not look like crawl times(2000-01-01 .. now+1 day), else None"""
 
-while True:
+    first = db.zrange(key, 0, 0, withscores=True)
+    last = db.zrange(key, -1, -1, withscores=True)
+    if not first or (first[0][1]>=946684800 and last[0][1]<=now+24*3600):
+        return None
+    return first[0][1], last[0][1]
 
-    cur, items = db.zscan('urlset2', cur)
-    idx += len(items)
+def skip(key, scores, hint):
 
-    if idx>1e4:
-        idx = 0
-        print datetime.now(), cnt, '/', tot
+    print >>sys.stderr, datetime.now(), 'skip {}: scores {:g}..{:g} are not epoch timestamps(crawl time), {}'.format(
+        key, scores[0], scores[1], hint)
 
-    for k,v in items:
-        dt = datetime.fromtimestamp(v)
-        if dt<ago:
-            with db.pipeline() as p:
-                p.zrem('urlset', k)
-                p.zrem('urlset2', k)
-                p.delete(k)
-                p.execute()
-                cnt += 1
+def purge_legacy(db, key, index, cutoff, chunk, dry_run=False):
+    r"""expired members of index(old layout): zrem from key and index, delete their per-hash keys"""
 
-    if cur==0:
-        break
+    if dry_run:
+        return db.zcount(index, '-inf', cutoff)
+
+    total = 0
+    while True:
+        members = db.zrangebyscore(index, '-inf', cutoff, start=0, num=chunk)
+        if not members:
+            break
+        with db.pipeline() as p:
+            p.zrem(key, *members)
+            p.zrem(index, *members)
+            p.delete(*members)
+            p.execute()
+        total += len(members)
+        print datetime.now(), index, 'removed', total
+    return total
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='expire old url hashes from urlset')
+    parser.add_argument('-r', '--redis', default='redis://localhost:6379/0', help='redis uri')
+    parser.add_argument('-k', '--key', default='urlset', help='sorted set of url hashes')
+    parser.add_argument('-d', '--days', type=float, default=7, help='keep urls crawled in the last N days')
+    parser.add_argument('-c', '--chunk', type=int, default=10000, help='max members removed per call')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only count expired members')
+    parser.add_argument('-b', '--buckets', action='store_true', help='purge <key>:N buckets instead of <key>')
+    parser.add_argument('--no-legacy', action='store_true', help='do not purge the old layout(<key>2 and per-hash keys)')
+    args = parser.parse_args()
+
+    db = redis.StrictRedis.from_url(args.redis)
+    now = time.time()
+    cutoff = '({}'.format(now-args.days*24*3600)
+    chunk = max(1, args.chunk)
+
+    tot = cnt = 0
+    index = args.key+'2'
+    legacy = not args.no_legacy and not args.buckets and db.type(index)=='zset'
+    if legacy:
+        scores = bad_scores(db, index, now)
+        if scores:
+            skip(index, scores, 'its members are not expired')
+        else:
+            tot += db.zcard(index)
+            cnt += purge_legacy(db, args.key, index, cutoff, chunk, args.dry_run)
+
+    if args.buckets:
+        keys = db.scan_iter(match='{}:*'.format(args.key), count=1000)
+    else:
+        keys = [args.key]
+
+    for key in keys:
+        scores = bad_scores(db, key, now)
+        if scores:
+            if legacy:
+                hint = 'rewrite them with those of {0}: scripts/migrate-urlset.py -k {1} --fp hex --scores {0} --replace'.format(index, key)
+            else:
+                hint = 'rewrite them with crawl times: scripts/migrate-urlset.py -k {} --scores <sorted set of crawl times>'.format(key)
+            skip(key, scores, hint)
+            continue
+        tot += db.zcard(key)
+        cnt += purge(db, key, cutoff, chunk, args.dry_run)
+    print datetime.now(), '{} {} / {}'.format('expired' if args.dry_run else 'removed', cnt, tot)
 
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from datetime import datetime
+from webbot.utils import dateparser
+import unittest
+
+class ParseDateTest(unittest.TestCase):
+
+    def setUp(self):
+
+        dateparser._memo.clear()
+
+    def test_iso(self):
+
+        self.assertEqual(dateparser.parse_date(u'2014-01-01T01:02'), datetime(2014, 1, 1, 1, 2))
+        self.assertEqual(dateparser.parse_date(u'2014-01-01 01:02:03'), datetime(2014, 1, 1, 1, 2, 3))
+
+    def test_iso_not_padded(self):
+
+        # parsed field by field(was 2014-01-11 11:02 when the digits were run together)
+        self.assertEqual(dateparser.parse_date(u'2014-1-1T1:2'), datetime(2014, 1, 1, 1, 2))
+        self.assertEqual(dateparser.parse_date(u'2014-1-1T1:2:3'), datetime(2014, 1, 1, 1, 2, 3))
+        self.assertEqual(dateparser.parse_date(u'2019-12-1T0:33'), datetime(2019, 12, 1, 0, 33))
+
+    def test_iso_tz(self):
+
+        self.assertEqual(dateparser.parse_date(u'2014-1-1T1:2', tz='+08:00'), datetime(2013, 12, 31, 17, 2))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from scrapy.http import HtmlResponse, XmlResponse
+from scrapy.selector import Selector
+from webbot.utils.extractor import FieldPlan
+from webbot.utils.utils import MacroExpander
+import unittest
+
+BODY = '<rss><channel><item><title>a &amp; b</title><desc><p/><br/></desc></item></channel></rss>'
+
+class FieldPlanTest(unittest.TestCase):
+
+    def check(self, cls):
+
+        macro = MacroExpander({})
+        e = Selector(cls(url='http://www.example.com/', body=BODY)).xpath('//item')[0]
+        for expr in ['./desc', './title', './title/text()']:
+            self.assertEqual(FieldPlan('f', {'xpath':expr}).raw(e, macro, {}), e.xpath(expr).extract())
+
+    def test_same_as_selector_xml(self):
+
+        self.check(XmlResponse)
+
+    def test_same_as_selector_html(self):
+
+        self.check(HtmlResponse)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from webbot.utils import jpath
+import json
+import unittest
+
+BODY = 'callback({"data": [{"a": 1, "b": 2.5, "c": [1, 2]}, {"a": "x\\u4e2d", "b": null}], "n": 2});'
+
+class StreamPrefixTest(unittest.TestCase):
+
+    def test_simple(self):
+
+        self.assertEqual(jpath.stream_prefix('$[*]'), 'item')
+        self.assertEqual(jpath.stream_prefix('$.data[*]'), 'data.item')
+        self.assertEqual(jpath.stream_prefix("$['a'].b[*]"), 'a.b.item')
+
+    def test_not_streamable(self):
+
+        self.assertIsNone(jpath.stream_prefix(None))
+        self.assertIsNone(jpath.stream_prefix('$.data[0]'))
+        self.assertIsNone(jpath.stream_prefix('$..data[*]'))
+
+@unittest.skipUnless(jpath.ijson, 'ijson is not installed(json_stream)')
+class StreamTest(unittest.TestCase):
+
+    def test_same_as_jsonpath(self):
+
+        obj = json.loads(BODY[BODY.find('{'):BODY.rfind('}')+1])
+        self.assertEqual(list(jpath.stream(BODY, 'data.item')), jpath.jsonpath(obj, '$.data[*]'))
+
+    def test_no_json(self):
+
+        self.assertEqual(list(jpath.stream('no json here', 'item')), [])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+#
+# run from the top directory:
+#
+#   $ python -m unittest discover -s tests
+#
+
+from webbot.utils.parser import Lookup, make_parser
+import unittest
+
+class HttpParserTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.http = make_parser({'type':'http', 'async':True})
+
+    def test_async_lookup(self):
+
+        value = self.http([u'http://www.example.com/a', u'http://www.example.com/b'])
+        self.assertEqual(len(value), 1)
+        self.assertIsInstance(value[0], Lookup)
+        self.assertEqual(value[0].urls, [u'http://www.example.com/a', u'http://www.example.com/b'])
+
+    def test_async_empty(self):
+
+        # empty like any other parser, so opt/default apply(no Lookup of nothing)
+        self.assertEqual(self.http([]), [])
+        self.assertEqual(self.http(None), [])
+        self.assertEqual(self.http.batch([[], [u'http://www.example.com/']])[0], [])
+
+    def test_async_empty_pipe(self):
+
+        pipe = make_parser([{'type':'http', 'async':True}, 'strip'])
+        self.assertEqual(pipe([]), [])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from scrapy.http import HtmlResponse
+from scrapy.item import Field, Item
+from scrapy.selector import Selector
+from scrapy.utils.test import get_crawler
+from webbot.pipelines import HttpPipeline
+from webbot.utils.extractor import FieldPlan
+from webbot.utils.parser import Lookup
+from webbot.utils.utils import MacroExpander
+import unittest
+
+BODY = '<ul><li><a href="http://www.example.com/a">a</a></li></ul>'
+
+class TestItem(Item):
+
+    f = Field()
+
+class HttpPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pipeline = HttpPipeline.from_crawler(get_crawler())
+        self.element = Selector(HtmlResponse(url='http://www.example.com/', body=BODY)).xpath('//li')[0]
+
+    def lookup(self, inf):
+
+        inf = dict({'xpath':'./a/@href', 'parse':{'type':'http', 'async':True}}, **inf)
+        value = FieldPlan('f', inf).extract(self.element, MacroExpander({}), {'FOO':'foo'})
+        self.assertTrue(isinstance(value[0], Lookup))
+        item = TestItem(f=value)
+        return item, value
+
+    def test_found(self):
+
+        item, value = self.lookup({'default':'${FOO}-default'})
+        self.pipeline.set_value([[u'body']], item, 'f', value)
+        self.assertEqual(item['f'], [u'body'])
+
+    def test_empty_default(self):
+
+        # same as the synchronous parser: the default(expanded at extraction) applies
+        item, value = self.lookup({'default':'${FOO}-default'})
+        self.pipeline.set_value([[]], item, 'f', value)
+        self.assertEqual(item['f'], [u'foo-default'])
+
+    def test_empty(self):
+
+        item, value = self.lookup({})
+        self.pipeline.set_value([[]], item, 'f', value)
+        self.assertNotIn('f', item)
+
+if __name__=='__main__':
+    unittest.main()
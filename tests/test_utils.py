@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from webbot.utils import utils
+import os
+import shutil
+import tempfile
+import unittest
+
+PLUGIN = '''
+NAME = {0!r}
+
+def parse(data):
+    return {0!r}
+'''
+
+class LoadPluginTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.mkdtemp()
+        self.paths = []
+        for name in ['a', 'b']:
+            path = os.path.join(self.tmp, name+'.py')
+            with open(path, 'w') as f:
+                f.write(PLUGIN.format(name))
+            self.paths.append(path)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmp)
+
+    def check(self, cache=None):
+
+        a, b = [utils.load_plugin(p, cache=cache) for p in self.paths]
+        self.assertIsNot(a, b)
+        self.assertEqual((a.NAME, a.parse(None)), ('a', 'a'))
+        self.assertEqual((b.NAME, b.parse(None)), ('b', 'b'))
+
+    def test_own_module(self):
+
+        self.check()
+
+    def test_own_module_cached(self):
+
+        self.check(utils.ConfigCache(os.path.join(self.tmp, 'cache')))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from copy import deepcopy
+from scrapy import log, signals
+from scrapy.command import ScrapyCommand
+from scrapy.crawler import Crawler
+from scrapy.exceptions import UsageError
+from scrapy.resolver import CachingThreadedResolver
+from scrapy.utils.ossignal import install_shutdown_handlers, signal_names
+from twisted.internet import defer, reactor
+import signal
+import traceback
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return '[options] <config> [config ...]'
+
+    def short_desc(self):
+        return 'Run many configs as concurrent crawlers in one process'
+
+    def long_desc(self):
+        return ('Run every config with its own crawler(stats, pipelines, extensions) on a shared reactor. '
+                'CONCURRENT_REQUESTS(or --split) is split evenly and statically between the crawlers: '
+                'each one gets a fixed share, an idle crawler does not give its share to the others.')
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option('-f', '--file', dest='list', metavar='FILE',
+                          help='read config paths from FILE(one per line)')
+        parser.add_option('--split', type='int', metavar='N',
+                          help='concurrent requests split evenly between the crawlers, '
+                               'a fixed N/<configs> each(default: CONCURRENT_REQUESTS)')
+        parser.add_option('--spider', default='webbot', metavar='NAME',
+                          help='spider to run(default: webbot)')
+
+    def run(self, args, opts):
+
+        configs = list(args)
+        if opts.list:
+            with open(opts.list) as f:
+                configs.extend(i.strip() for i in f if i.strip() and not i.startswith('#'))
+        if not configs:
+            raise UsageError()
+
+        total = opts.split or self.settings.getint('CONCURRENT_REQUESTS')
+        share = max(1, total//len(configs))
+
+        log.start_from_settings(self.settings)
+        log.scrapy_info(self.settings)
+        log.msg('run {} configs, {} concurrent requests each(static split of {})'.format(len(configs), share, total))
+
+        self.crawlers = []
+        for path in configs:
+            crawler = self.create_crawler(path, share, opts.spider)
+            if crawler:
+                self.crawlers.append(crawler)
+
+        if not self.crawlers:
+            return
+
+        self.running = len(self.crawlers)
+        for crawler in self.crawlers:
+            crawler.signals.connect(self.crawler_stopped, signals.engine_stopped)
+            crawler.start()
+
+        install_shutdown_handlers(self.shutdown)
+        if self.settings.getbool('DNSCACHE_ENABLED'):
+            reactor.installResolver(CachingThreadedResolver(reactor))
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        reactor.run(installSignalHandlers=False)
+
+    def create_crawler(self, path, share, name):
+
+        # per-crawler overrides: its config, and its fixed share of the
+        # concurrency(per domain capped at the share)
+        settings = deepcopy(self.settings)
+        settings.setdict({
+            'config': path,
+            'CONCURRENT_REQUESTS': share,
+            'CONCURRENT_REQUESTS_PER_DOMAIN': min(share, settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')),
+        }, priority='cmdline')
+
+        try:
+            crawler = Crawler(settings)
+            crawler.configure()
+            crawler.crawl(crawler.spiders.create(name))
+            return crawler
+        except Exception as ex:
+            log.msg(u'cannot load config <{}>:\n{}'.format(path, traceback.format_exc()), level=log.ERROR)
+            return None
+
+    def crawler_stopped(self):
+
+        self.running -= 1
+        if self.running<=0:
+            self.stop_reactor()
+
+    def stop(self):
+
+        return defer.DeferredList([c.stop() for c in self.crawlers])
+
+    def shutdown(self, signum, _):
+
+        install_shutdown_handlers(self.kill)
+        log.msg('Received {}, shutting down gracefully. Send again to force'.format(signal_names[signum]))
+        reactor.callFromThread(self.stop)
+
+    def kill(self, signum, _):
+
+        install_shutdown_handlers(signal.SIG_IGN)
+        log.msg('Received {} twice, forcing unclean shutdown'.format(signal_names[signum]))
+        reactor.callFromThread(self.stop_reactor)
+
+    def stop_reactor(self):
+
+        try:
+            reactor.stop()
+        except RuntimeError:
+            pass
+
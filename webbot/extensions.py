@@ -5,6 +5,7 @@ from datetime import datetime
 from scrapy import log
 from scrapy import signals
 from webbot.utils import utils
+from webbot.utils.sink import SinkWorker
 import os
 
 class StatsPoster(object):
@@ -30,28 +31,35 @@ class StatsPoster(object):
 
     def spider_closed(self, spider, reason):
         if self.enabled and hasattr(spider, 'logger'):
-            try:
-                uri = spider.logger
-                if not uri:
-                    return
-
-                log.msg('post bot stats to <{}>'.format(uri))
-                cnn, db, tbl = utils.connect_uri(uri)
-
-                ago = self.stats.get_value('start_time', datetime.utcnow())
-                now = datetime.utcnow()
-
-                self.stats.set_value('finish_time', now, spider=spider)
-                self.stats.set_value('elapsed_time', (now-ago).total_seconds(), spider=spider)
-                self.stats.set_value('finish_reason', reason, spider=spider)
-                self.stats.set_value('bot_ip', utils.get_ipaddr())
-                self.stats.set_value('bot_name', self.crawler.settings.get('BOT_NAME', 'unknown'))
-                self.stats.set_value('spider_name', spider.name)
-                self.stats.set_value('config_path', spider.config)
-                self.stats.set_value('job_id', os.getenv('SCRAPY_JOB', None))
-
-                tbl.insert({k.replace('.', '_'):v for k,v in self.stats.get_stats().iteritems()})
-                cnn.close()
-            except Exception as ex:
-                log.err('cannot post bot stats')
+            uri = spider.logger
+            if not uri:
+                return
 
+            ago = self.stats.get_value('start_time', datetime.utcnow())
+            now = datetime.utcnow()
+
+            self.stats.set_value('finish_time', now, spider=spider)
+            self.stats.set_value('elapsed_time', (now-ago).total_seconds(), spider=spider)
+            self.stats.set_value('finish_reason', reason, spider=spider)
+            self.stats.set_value('bot_ip', utils.get_ipaddr())
+            self.stats.set_value('bot_name', self.crawler.settings.get('BOT_NAME', 'unknown'))
+            self.stats.set_value('spider_name', spider.name)
+            self.stats.set_value('config_path', spider.config)
+            self.stats.set_value('job_id', os.getenv('SCRAPY_JOB', None))
+
+            # connect/insert in a worker thread, the reactor keeps running
+            doc = {k.replace('.', '_'):v for k,v in self.stats.get_stats().iteritems()}
+            worker = SinkWorker('logger')
+            worker.start()
+            dfd = worker.submit(1, self.post, uri, doc)
+            dfd.addErrback(lambda f: log.msg('cannot post bot stats: {}'.format(f.getErrorMessage()), level=log.ERROR))
+            dfd.addBoth(lambda _: worker.stop())
+            return dfd
+
+    def post(self, uri, doc):
+        log.msg('post bot stats to <{}>'.format(uri))
+        cnn, db, tbl = utils.connect_uri(uri)
+        try:
+            tbl.insert(doc)
+        finally:
+            cnn.close()
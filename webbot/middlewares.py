@@ -3,11 +3,12 @@
 
 from scrapy import signals, log
 from scrapy.contrib.downloadermiddleware import retry
-from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
 from scrapy.http import Request
+from twisted.internet import reactor, task, threads
 from urlparse import urlparse
 from webbot.utils import utils
-import random, re
+import random, re, time
 
 # 随机切换代理
 class ProxyMiddleware(object):
@@ -72,15 +73,34 @@ class ProxyMiddleware(object):
 
 
 # URL去除重复
+class ParkedRequest(IgnoreRequest):
+    r"""request waiting for its dedup lookup, crawled again if unseen(not a real ignore)"""
+
+
 class DedupMiddleware(object):
+    r"""two-tier url dedup: local LRU cache, then batched redis lookups off the reactor thread
+
+    A request missing from the cache is parked(ParkedRequest, counted in
+    dedup/parked) and looked up with other parked requests in one pipelined
+    round trip. Unseen requests are crawled again with meta['dedup_checked'].
 
-    def __init__(self, stats):
-        self.stats = stats
+    Pages that produced items are recorded in urlset(score: crawl time),
+    in batches of ZADD, see scripts/purge-redis.py for expiry.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.waiting = {}
+        self.parked = []
+        self.timer = None
 
     @classmethod
     def from_crawler(cls, crawler):
-        o = cls(crawler.stats)
+        o = cls(crawler)
         crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(o.item_scraped, signal=signals.item_scraped)
         crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
         return o
 
@@ -101,29 +121,176 @@ class DedupMiddleware(object):
                 log.msg('connect dedup <{}>'.format(uri))
                 self.db = redis.StrictRedis.from_url(uri)
                 self.db.ping()
-                self.enabled = True
+                self.setup(spider)
                 return
             except Exception as ex:
                 log.err('cannot connect dedup')
 
         self.enabled = False
 
+    def setup(self, spider):
+        self.fpr = utils.UrlFingerprint(getattr(spider, 'dedup_fp', 'hex'), getattr(spider, 'dedup_buckets', 0))
+        self.cache = utils.LRUCache(getattr(spider, 'dedup_cache', 100000))
+        self.batch = max(1, getattr(spider, 'dedup_batch', 100))
+        self.delay = getattr(spider, 'dedup_delay', 0.01)
+        self.record = getattr(spider, 'dedup_record', True)
+        self.flush_size = max(1, getattr(spider, 'dedup_flush', 500))
+        self.scraped = {}
+        self.writer = task.LoopingCall(self.write, spider)
+        self.writer.start(getattr(spider, 'dedup_interval', 5), now=False)
+        self.enabled = True
+
     def process_request(self, request, spider):
-        if self.enabled:
-            url = request.url
-            sha1 = utils.hash_url(url)
-            try:
-                if self.db.zrank('urlset', sha1) is not None:
-                    log.msg('Dropped <url: {}> (hash: {})'.format(url, sha1), level=log.DEBUG)
-                    self.stats.inc_value('item_duplicated_count', spider=spider)
-                    raise IgnoreRequest()
-            except IgnoreRequest as ex:
-                raise
-            except Exception as ex:
-                self.stats.inc_value('redis/exception_count', spider=spider)
+        if not self.enabled or request.meta.get('dedup_checked'):
+            return
+
+        url = request.url
+        fp = self.fpr.fp(url)
+        seen = self.cache.get(fp)
+
+        if seen is None:
+            self.stats.inc_value('dedup/cache_miss', spider=spider)
+            self.park(fp, request, spider)
+            raise ParkedRequest()
+
+        self.stats.inc_value('dedup/cache_hit', spider=spider)
+        if seen:
+            self.drop(url, fp, spider)
+
+    def drop(self, url, fp, spider):
+        log.msg('Dropped <url: {}> (hash: {})'.format(url, self.hexfp(fp)), level=log.DEBUG)
+        self.stats.inc_value('item_duplicated_count', spider=spider)
+        raise IgnoreRequest()
+
+    def hexfp(self, fp):
+        return fp if self.fpr.fmt=='hex' else fp.encode('hex')
+
+    def park(self, fp, request, spider):
+        self.stats.inc_value('dedup/parked', spider=spider)
+        key = id(request)
+        self.waiting[key] = (fp, request, spider)
+        self.parked.append((key, (fp, request, spider)))
+        if len(self.parked)>=self.batch:
+            self.flush()
+        elif not self.timer:
+            self.timer = reactor.callLater(self.delay, self.flush)
+
+    def flush(self):
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        entries, self.parked = self.parked, []
+        for i in xrange(0, len(entries), self.batch):
+            chunk = entries[i:i+self.batch]
+            d = threads.deferToThread(self.lookup, set(fp for k,(fp,r,s) in chunk))
+            d.addCallbacks(self.resolve, self.failed, callbackArgs=(chunk,), errbackArgs=(chunk,))
+
+    def lookup(self, keys):
+        r"""one pipelined round trip for many keys(runs in a thread)"""
+        keys = list(keys)
+        pipe = self.db.pipeline(transaction=False)
+        for fp in keys:
+            pipe.zscore(self.fpr.key(fp), fp)
+        return {fp:score is not None for fp,score in zip(keys, pipe.execute())}
+
+    def resolve(self, results, chunk):
+        for key, (fp, request, spider) in chunk:
+            # resolved by spider_idle already
+            if self.waiting.pop(key, None) is None:
+                continue
+            seen = results.get(fp, False)
+            self.cache.set(fp, seen)
+            if seen:
+                log.msg('Dropped <url: {}> (hash: {})'.format(request.url, self.hexfp(fp)), level=log.DEBUG)
+                self.stats.inc_value('item_duplicated_count', spider=spider)
+            else:
+                request = request.replace(dont_filter=True)
+                request.meta['dedup_checked'] = True
+                self.crawler.engine.crawl(request, spider)
+        if results:
+            self.stats.inc_value('dedup/redis_batches', spider=spider)
+            self.stats.inc_value('dedup/redis_keys', len(results), spider=spider)
+            self.stats.max_value('dedup/redis_batch_max', len(results), spider=spider)
+        if not self.waiting:
+            self.wake()
+
+    def wake(self):
+        r"""all parked requests resolved: check for idle now, not at the next heartbeat(after DontCloseSpider)"""
+        slot = getattr(self.crawler.engine, 'slot', None)
+        if slot and slot.nextcall:
+            reactor.callLater(0, slot.nextcall)
+
+    def failed(self, failure, chunk):
+        # let them through, as when redis raised before
+        log.msg('dedup lookup failed: {}'.format(failure.getErrorMessage()), level=log.WARNING)
+        self.resolve({}, chunk)
+        if chunk:
+            self.stats.inc_value('redis/exception_count', spider=chunk[0][1][2])
+
+    def spider_idle(self, spider):
+        r"""nothing else to do: look up parked requests now, the spider stays open until they are resolved"""
+        if not self.waiting:
+            return
+        self.flush()
+        raise DontCloseSpider()
+
+    def item_scraped(self, item, response, spider):
+        r"""record followed pages that produced items(start urls are crawled every time)"""
+        if not (self.enabled and self.record) or 'rule' not in response.meta:
+            return
+        # the url dedup was checked against(before redirects)
+        url = response.meta.get('redirect_urls', [response.url])[0]
+        fp = self.fpr.fp(url)
+        if fp not in self.scraped:
+            self.scraped[fp] = int(time.time())
+            self.cache.set(fp, True)
+            if len(self.scraped)>=self.flush_size:
+                self.write(spider)
+
+    def write(self, spider):
+        if not self.scraped:
+            return
+        entries, self.scraped = self.scraped.items(), {}
+        d = threads.deferToThread(self.zadd, entries)
+        d.addCallbacks(self.written, self.write_failed, callbackArgs=(spider,), errbackArgs=(entries, spider))
+        return d
+
+    def zadd(self, entries):
+        r"""ZADD urlset(or its buckets) in chunks, one pipelined round trip(runs in a thread)"""
+        groups = {}
+        for fp, ts in entries:
+            groups.setdefault(self.fpr.key(fp), []).extend([ts, fp])
+        pipe = self.db.pipeline(transaction=False)
+        for key, args in groups.iteritems():
+            for i in xrange(0, len(args), 2000):
+                # same command for redis-py 2.x/3.x(zadd signatures differ)
+                pipe.execute_command('ZADD', key, *args[i:i+2000])
+        pipe.execute()
+        return len(entries)
+
+    def written(self, count, spider):
+        self.stats.inc_value('dedup/recorded', count, spider=spider)
+        self.stats.inc_value('dedup/record_batches', spider=spider)
+
+    def write_failed(self, failure, entries, spider):
+        log.msg('cannot record {} urls: {}'.format(len(entries), failure.getErrorMessage()), level=log.WARNING)
+        self.stats.inc_value('redis/exception_count', spider=spider)
 
     def spider_closed(self, spider, reason):
-        pass
+        if self.enabled:
+            self.stats.set_value('dedup/cache_size', len(self.cache), spider=spider)
+            hit = self.stats.get_value('dedup/cache_hit', 0, spider=spider)
+            miss = self.stats.get_value('dedup/cache_miss', 0, spider=spider)
+            if hit+miss:
+                self.stats.set_value('dedup/cache_hit_rate', round(1.0*hit/(hit+miss), 4), spider=spider)
+            if self.timer and self.timer.active():
+                self.timer.cancel()
+            self.waiting.clear()
+            self.parked = []
+            if self.writer.running:
+                self.writer.stop()
+            return self.write(spider)
 
 # 非法请求过滤
 class RequestMiddleware(object):
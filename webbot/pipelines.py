@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
+from collections import OrderedDict
 from datetime import datetime
-from scrapy import log
+from scrapy import log, signals
 from scrapy.exceptions import DropItem
-from scrapy.item import Item, Field
+from scrapy.item import Field
+from scrapy.utils.misc import arg_to_iter
+from twisted.internet import defer, reactor, task
+from twisted.python.failure import Failure
 from webbot.utils import utils, dateparser
+from webbot.utils.fetcher import Fetcher
+from webbot.utils.fingerprint import ContentFingerprint, PendingFingerprint, open_store
+from webbot.utils.parser import Lookup
+from webbot.utils.sink import SinkWorker
+import itertools
 import pprint
 import re
+import time
 import traceback
+import zlib
 
 
 # 字段映射(mapping)
@@ -21,12 +32,120 @@ def item2post(item):
     return post
 
 
+def post_size(post):
+
+    size = 0
+    for k,v in post.iteritems():
+        size += len(k) + (len(v) if isinstance(v, basestring) else 8)
+    return size
+
+
+def get_upsert_keys(spider):
+
+    keys = []
+    for k,v in spider.item_cls.fields.iteritems():
+        if 'name' in v and v.get('upsert'):
+            keys.append(v['name'])
+    return keys
+
+
+# 未变化的数据不再写入(fingerprint: mark)
+def unchanged(item):
+
+    return getattr(item, '_unchanged', False)
+
+
+# 入库后才保存的指纹(fingerprint)
+def pending_fingerprint(item):
+
+    return getattr(item, '_fingerprint', None)
+
+
+# 异步查询(http)
+class HttpPipeline(object):
+    r"""resolve lookups of async http parsers, the item waits for them
+
+    Lookups of all items share one Fetcher(connection pool, cache and
+    per-host limits), other responses are processed meanwhile.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.fetcher = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        self.spider = spider
+
+    def get_fetcher(self):
+        if not self.fetcher:
+            spider = self.spider
+            self.fetcher = Fetcher(
+                per_host=getattr(spider, 'http_per_host', 4),
+                cache=getattr(spider, 'http_cache', 1000),
+                ttl=getattr(spider, 'http_ttl', 300),
+                user_agent=getattr(spider, 'user_agent', None) or self.crawler.settings.get('USER_AGENT'),
+                stats=self.stats,
+                spider=spider
+            )
+        return self.fetcher
+
+    def process_item(self, item, spider):
+        dfds = []
+        for k,v in item.iteritems():
+            if isinstance(v, list) and any(isinstance(i, Lookup) for i in v):
+                dfd = defer.gatherResults([self.resolve(i) for i in v])
+                dfd.addCallback(self.set_value, item, k, v)
+                dfds.append(dfd)
+        if not dfds:
+            return item
+        return defer.gatherResults(dfds).addCallback(lambda _: item)
+
+    def resolve(self, value):
+        if not isinstance(value, Lookup):
+            return defer.succeed([value])
+        http = value.parser
+        dfds = [self.get_fetcher().fetch(url, http.method, http.data, http.timeout) for url in value.urls]
+        dfd = defer.DeferredList(dfds, consumeErrors=True)
+        dfd.addCallback(self.resolved, value)
+        return dfd
+
+    def resolved(self, results, value):
+        bodies = []
+        for (ok, body), url in zip(results, value.urls):
+            if ok:
+                bodies.append(body)
+            else:
+                reason = getattr(body.value, 'reasons', [body])[0]
+                log.msg(u'http lookup <{}> failed: {} {}'.format(url, reason.type.__name__, reason.getErrorMessage()), level=log.WARNING)
+        return value.resolve(bodies)
+
+    def set_value(self, results, item, k, lookups):
+        values = [x for r in results for x in arg_to_iter(r)]
+        if not values:
+            # the field default(expanded at extraction, see FieldPlan.fill)
+            values = [x for i in lookups if isinstance(i, Lookup) for x in i.default or []]
+        if values:
+            item[k] = values
+        else:
+            # same as a field that extracted nothing(see BasicPipeline)
+            del item[k]
+
+    def close_spider(self, spider):
+        if self.fetcher:
+            return self.fetcher.close()
+
+
 # 基本处理(basic)
 class BasicPipeline(object):
 
     def open_spider(self, spider):
 
-        self.img = 'image_urls' in Item.fields
+        self.img = 'image_urls' in spider.item_cls.fields
 
     def process_item(self, item, spider):
 
@@ -45,7 +164,7 @@ class BasicPipeline(object):
                 elif v.get('opt'):
                     item[k] = None
                 else:
-                    raise Exception('field [{}] is empty'%k)
+                    raise Exception('field [{}] is empty'.format(k))
 
             return item
 
@@ -91,126 +210,614 @@ class DebugPipeline(object):
         return item
 
 
+# 内容指纹(fingerprint)
+class FingerprintPipeline(object):
+    r"""drop(or mark) items whose mapped post is the same as last crawl
+
+    Fingerprints are keyed by the upsert fields(or url) and kept in a local
+    dbm file or a redis hash. Items are checked in batches, a fingerprint
+    is only saved once the item is stored: it has passed all pipelines and
+    every mysql/mongo/zmq batch holding it was written(see
+    PendingFingerprint). Redis lookups and saves run one at a time, in
+    order, in a dedicated thread.
+    """
+
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+        self.store = None
+        self.waiting = []
+        self.timer = None
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.item_dropped, signal=signals.item_dropped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        if hasattr(spider, 'fingerprint'):
+            try:
+                uri = spider.fingerprint
+                log.msg('connect fingerprint <{}>'.format(uri))
+                self.store = open_store(uri)
+                self.setup(spider)
+                return
+            except Exception as ex:
+                log.err('cannot open fingerprint: {}'.format(ex))
+
+        self.store = None
+
+    def setup(self, spider):
+        self.spider = spider
+        self.mark = getattr(spider, 'fingerprint_mode', 'drop')=='mark'
+        self.batch = max(1, getattr(spider, 'fingerprint_batch', 100))
+        self.delay = getattr(spider, 'fingerprint_delay', 0.05)
+        text = getattr(spider, 'fingerprint_simhash', None)
+        if text is True:
+            text = [v['name'] for k,v in spider.item_cls.fields.iteritems() if 'name' in v]
+        self.fp = ContentFingerprint(
+            keys=get_upsert_keys(spider),
+            ignore=getattr(spider, 'fingerprint_ignore', None),
+            text=text,
+            distance=getattr(spider, 'fingerprint_distance', 3)
+        )
+        self.pending = set()
+        self.confirmed = OrderedDict()
+        self.save_timer = None
+        self.drained = None
+        if self.store.remote:
+            self.worker = SinkWorker('fingerprint', 1)
+            self.worker.start()
+            self.run = lambda func, *args: self.worker.submit(0, func, *args)
+        else:
+            self.worker = None
+            self.run = defer.maybeDeferred
+
+    def process_item(self, item, spider):
+        if not self.store:
+            return item
+
+        key, value = self.fp(item2post(item), item.get('url'))
+        dfd = defer.Deferred()
+        self.waiting.append((key, value, item, dfd))
+        if len(self.waiting)>=self.batch:
+            self.flush()
+        elif not self.timer:
+            self.timer = reactor.callLater(self.delay, self.flush)
+        return dfd
+
+    def flush(self):
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        waiting, self.waiting = self.waiting, []
+        if not waiting:
+            return
+
+        self.stats.inc_value('fingerprint/batches', spider=self.spider)
+        dfd = self.run(self.check, [(k, v) for k,v,_,_ in waiting])
+        dfd.addCallbacks(self.resolve, self.failed, callbackArgs=(waiting,), errbackArgs=(waiting,))
+        return dfd
+
+    def check(self, pairs):
+        r"""compare with stored fingerprints(runs in a thread for redis)"""
+
+        found = self.store.get_many([k for k,v in pairs])
+        return [self.fp.compare(old, v) for old, (k, v) in zip(found, pairs)]
+
+    def resolve(self, result, waiting):
+        for state, (key, value, item, dfd) in zip(result, waiting):
+            self.stats.inc_value('fingerprint/{}'.format(state), spider=self.spider)
+            if state in ['new', 'changed']:
+                item._fingerprint = PendingFingerprint(key, value, self.settle)
+                self.pending.add(item._fingerprint)
+                dfd.callback(item)
+            elif self.mark:
+                item._unchanged = True
+                dfd.callback(item)
+            else:
+                dfd.errback(DropItem('item unchanged'))
+
+    def failed(self, failure, waiting):
+        self.stats.inc_value('fingerprint/exception_count', spider=self.spider)
+        log.msg('fingerprint error: {}'.format(failure.getErrorMessage()), level=log.WARNING)
+        for _, _, item, dfd in waiting:
+            dfd.callback(item)
+
+    def item_scraped(self, item, response, spider):
+        fp = pending_fingerprint(item)
+        if fp:
+            fp.seal()
+
+    def item_dropped(self, item, spider, exception):
+        fp = pending_fingerprint(item)
+        if fp:
+            fp.cancel()
+
+    def settle(self, fp, ok):
+        r"""fp is stored(ok) or will never be, save confirmed fingerprints in batches"""
+
+        self.pending.discard(fp)
+        if ok:
+            self.confirmed[fp.key] = fp.value
+            if len(self.confirmed)>=self.batch:
+                self.save()
+            elif not self.save_timer:
+                self.save_timer = reactor.callLater(self.delay, self.save)
+        else:
+            self.stats.inc_value('fingerprint/unsaved', spider=self.spider)
+        if self.drained and not self.pending:
+            self.drained.callback(None)
+
+    def save(self):
+        if self.save_timer and self.save_timer.active():
+            self.save_timer.cancel()
+        self.save_timer = None
+
+        confirmed, self.confirmed = self.confirmed, OrderedDict()
+        if not confirmed:
+            return
+
+        dfd = self.run(self.store.set_many, confirmed)
+        dfd.addCallbacks(self.saved, self.failed_save, callbackArgs=(confirmed,))
+        return dfd
+
+    def saved(self, result, confirmed):
+        self.stats.inc_value('fingerprint/saved', len(confirmed), spider=self.spider)
+
+    def failed_save(self, failure):
+        self.stats.inc_value('fingerprint/exception_count', spider=self.spider)
+        log.msg('fingerprint error: {}'.format(failure.getErrorMessage()), level=log.WARNING)
+
+    def drain(self):
+        r"""fired when every pending fingerprint is saved or cancelled"""
+
+        for fp in list(self.pending):
+            if not fp.sealed:
+                fp.cancel()
+        if not self.pending:
+            return
+        self.drained = defer.Deferred()
+        return self.drained
+
+    def close_spider(self, spider):
+        if self.store:
+            dfd = defer.maybeDeferred(self.flush)
+            dfd.addBoth(lambda _: self.drain())
+            dfd.addBoth(lambda _: self.save())
+            dfd.addBoth(lambda _: self.close_store())
+            return dfd
+
+    def close_store(self):
+        log.msg('close fingerprint')
+        if self.worker:
+            self.worker.stop()
+        self.store.close()
+        self.store = None
+
+
+# 批量写入(buffered)
+class BufferedPipeline(object):
+    r"""items buffered and written in bulk by a dedicated worker thread
+
+    A flush happens every <name>_batch items, <name>_bytes(estimated) or
+    <name>_interval seconds, and on close. Rows with the same key are
+    collapsed(last one wins). Flushes run one at a time, in order(unless
+    <name>_threads>1). Once <name>_queue rows are waiting to be written,
+    process_item returns a Deferred, so scrapy stops feeding items. The
+    pending fingerprint of a row is released once its batch is written
+    without errors, cancelled otherwise.
+    """
+
+    name = None
+    max_threads = None
+    default_batch = 500
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.enabled = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def setup(self, spider):
+        self.spider = spider
+        self.batch = max(1, getattr(spider, self.name+'_batch', self.default_batch))
+        self.max_bytes = getattr(spider, self.name+'_bytes', 4*1024*1024)
+        self.buffer = OrderedDict()
+        self.holds = {}
+        self.size = 0
+        self.seq = itertools.count()
+        count = getattr(spider, self.name+'_threads', 1)
+        if self.max_threads:
+            count = min(count, self.max_threads)
+        self.worker = SinkWorker(self.name, count, getattr(spider, self.name+'_queue', self.batch*10))
+        self.worker.start()
+        self.timer = task.LoopingCall(self.flush)
+        self.timer.start(getattr(spider, self.name+'_interval', 5), now=False)
+        self.enabled = True
+
+    def add(self, item, key, row):
+        r"""buffer row, returns item(or a Deferred of it when the queue is full)"""
+        if key is None:
+            key = next(self.seq)
+        elif key in self.buffer:
+            self.inc_value('collapsed')
+            fp = self.holds.pop(key, None)
+            if fp:
+                fp.release(False)
+        self.buffer[key] = row
+        fp = pending_fingerprint(item)
+        if fp:
+            fp.hold()
+            self.holds[key] = fp
+        self.size += post_size(row)
+        if len(self.buffer)>=self.batch or self.size>=self.max_bytes:
+            self.flush()
+
+        if self.worker.full(len(self.buffer)):
+            if not self.worker.active:
+                self.flush()
+            self.inc_value('backpressure')
+            return self.worker.wait().addCallback(lambda _: item)
+        return item
+
+    def flush(self):
+        if not self.buffer:
+            return
+        rows, self.buffer, self.size = self.buffer.values(), OrderedDict(), 0
+        holds, self.holds = self.holds.values(), {}
+        dfd = self.worker.submit(len(rows), self.timed_write, rows)
+        dfd.addBoth(self.release, holds)
+        dfd.addCallbacks(self.written, self.failed, errbackArgs=(rows,))
+        self.set_value('queue_depth', self.worker.size)
+        self.max_value('queue_max', self.worker.size)
+        return dfd
+
+    def timed_write(self, rows):
+        start = time.time()
+        errors = self.write(rows)
+        return len(rows), errors or 0, time.time()-start
+
+    def write(self, rows):
+        r"""bulk write rows(runs in a thread), returns number of failed rows"""
+        raise NotImplementedError
+
+    def release(self, result, holds):
+        ok = not isinstance(result, Failure) and not result[1]
+        for fp in holds:
+            fp.release(ok)
+        return result
+
+    def written(self, result):
+        count, errors, elapsed = result
+        flushes = self.inc_value('flushes')
+        self.inc_value('written', count-errors)
+        self.count_errors(errors, count)
+        self.max_value('batch_max', count)
+        ms = int(elapsed*1000)
+        self.max_value('flush_time_max', ms)
+        self.inc_value('flush_time_total', ms)
+        self.set_value('flush_time_avg', self.get_value('flush_time_total')//flushes)
+        self.set_value('queue_depth', self.worker.size)
+
+    def count_errors(self, errors, count):
+        r"""rows of a batch that write() could not write"""
+        self.inc_value('errors', errors)
+        if errors:
+            log.msg('{}: {} of {} rows failed'.format(self.name, errors, count), level=log.WARNING)
+
+    def failed(self, failure, rows):
+        self.inc_value('errors', len(rows))
+        log.msg('{}: cannot write {} rows: {}'.format(self.name, len(rows), failure.getErrorMessage()), level=log.WARNING)
+
+    def close(self):
+        r"""flush, wait for pending writes and disconnect"""
+        if self.timer.running:
+            self.timer.stop()
+        self.flush()
+        dfd = self.worker.join()
+        dfd.addBoth(lambda _: self.disconnect())
+        dfd.addBoth(lambda _: self.worker.stop())
+        return dfd
+
+    def inc_value(self, key, count=1):
+        key = '{}/{}'.format(self.name, key)
+        self.stats.inc_value(key, count, spider=self.spider)
+        return self.stats.get_value(key, spider=self.spider)
+
+    def max_value(self, key, value):
+        self.stats.max_value('{}/{}'.format(self.name, key), value, spider=self.spider)
+
+    def set_value(self, key, value):
+        self.stats.set_value('{}/{}'.format(self.name, key), value, spider=self.spider)
+
+    def get_value(self, key):
+        return self.stats.get_value('{}/{}'.format(self.name, key), spider=self.spider)
+
+
 # 数据存储(mongo)
-class MongoPipeline(object):
+class MongoPipeline(BufferedPipeline):
+
+    name = 'mongo'
 
     def open_spider(self, spider):
         if hasattr(spider, 'mongo'):
             try:
-                self.upsert_keys = self.get_upsert_keys()
+                self.upsert_keys = get_upsert_keys(spider)
                 uri = spider.mongo
                 log.msg('connect <{}>'.format(uri))
                 self.cnn, self.db, self.tbl = utils.connect_uri(uri)
+                self.ensure_index()
+                self.setup(spider)
                 return
             except Exception as ex:
                 log.err('cannot connect to mongodb: {}'.format(ex))
 
         self.cnn = self.db = None
 
-    def get_upsert_keys(self):
-        keys = []
-        for k,v in Item.fields.iteritems():
-            if 'name' in v and v.get('upsert'):
-                keys.append(v['name'])
-        return keys
+    def ensure_index(self):
+        if not self.upsert_keys:
+            return
+        try:
+            import pymongo
+            name = self.tbl.create_index([(k, pymongo.ASCENDING) for k in self.upsert_keys], background=True)
+            log.msg('mongodb index <{}>'.format(name))
+        except Exception as ex:
+            log.msg('cannot create mongodb index: {}'.format(ex), level=log.WARNING)
 
     def process_item(self, item, spider):
-        if self.cnn:
-            try:
-                post = item2post(item)
-                if self.upsert_keys:
-                    criteria = {k:post[k] for k in self.upsert_keys}
-                    self.tbl.update(criteria, post, upsert=True)
-                else:
-                    self.tbl.insert(post)
-            except Exception as ex:
-                traceback.print_exc()
+        if self.cnn and not unchanged(item):
+            post = item2post(item)
+            if self.upsert_keys:
+                return self.add(item, repr(tuple(post[k] for k in self.upsert_keys)), post)
+            return self.add(item, None, post)
         return item
 
+    def write(self, rows):
+        from pymongo import InsertOne, ReplaceOne
+        from pymongo.errors import BulkWriteError
+        if self.upsert_keys:
+            ops = [ReplaceOne({k:post[k] for k in self.upsert_keys}, post, upsert=True) for post in rows]
+        else:
+            ops = [InsertOne(post) for post in rows]
+        try:
+            self.tbl.bulk_write(ops, ordered=False)
+        except BulkWriteError as ex:
+            return len(ex.details.get('writeErrors', []))
+
     def close_spider(self, spider):
         if self.cnn:
-            log.msg('disconnect mongodb')
-            self.cnn.close()
-            self.cnn = None
+            return self.close()
+
+    def disconnect(self):
+        log.msg('disconnect mongodb')
+        self.cnn.close()
+        self.cnn = None
 
 
 # 数据存储(mysql)
-class MysqlPipeline(object):
+class MysqlPipeline(BufferedPipeline):
+    r"""rows grouped by field set, one executemany per group, one transaction per flush
+
+    With upsert fields: INSERT ... ON DUPLICATE KEY UPDATE(needs a unique
+    index on them). A dropped connection is reopened and the flush retried
+    once, a failed batch falls back to row by row.
+    """
+
+    name = 'mysql'
+    max_threads = 1
+    disconnect_errors = set([0, 2006, 2013, 2014, 2045, 2055])
 
     def open_spider(self, spider):
         if hasattr(spider, 'mysql'):
             try:
-                uri = spider.mysql
-                log.msg('connect <{}>'.format(uri))
-                self.cnn, _, self.tbl = utils.connect_uri(uri)
-                self.cur = self.cnn.cursor()
+                self.uri = spider.mysql
+                self.upsert_keys = get_upsert_keys(spider)
+                self.statements = {}
+                self.reconnects = 0
+                log.msg('connect <{}>'.format(self.uri))
+                self.cnn, _, self.tbl = utils.connect_uri(self.uri)
+                self.setup(spider)
                 return
             except Exception as ex:
                 traceback.print_exc()
                 log.err('cannot connect to mysql: {}'.format(ex))
 
-        self.cnn = self.cur = None
+        self.cnn = None
 
     def process_item(self, item, spider):
-        if self.cnn:
-            try:
-                post = item2post(item)
-                fields = []
-                values = []
-                for k,v in post.iteritems():
-                    fields.append(k)
-                    values.append(v)
-
-                self.cur.execute(
-                    """INSERT INTO {}({}) VALUES({});""".format(
-                        self.tbl,
-                        ','.join(fields),
-                        ','.join(['%s']*len(fields))
-                    ),
-                    values
-                )
-
-                self.cnn.commit()
-            except Exception as ex:
-                traceback.print_exc()
+        if self.cnn and not unchanged(item):
+            post = item2post(item)
+            if self.upsert_keys:
+                return self.add(item, repr(tuple(post[k] for k in self.upsert_keys)), post)
+            return self.add(item, None, post)
         return item
 
+    def statement(self, fields):
+        if fields not in self.statements:
+            sql = 'INSERT INTO {}({}) VALUES({})'.format(self.tbl, ','.join(fields), ','.join(['%s']*len(fields)))
+            if self.upsert_keys:
+                update = [k for k in fields if k not in self.upsert_keys] or self.upsert_keys
+                sql += ' ON DUPLICATE KEY UPDATE {}'.format(','.join('{0}=VALUES({0})'.format(k) for k in update))
+            self.statements[fields] = sql
+        return self.statements[fields]
+
+    def write(self, rows):
+        groups = OrderedDict()
+        for post in rows:
+            fields = tuple(sorted(post))
+            groups.setdefault(fields, []).append([post[k] for k in fields])
+
+        try:
+            return self.execute(groups)
+        except Exception as ex:
+            if not self.is_disconnect(ex):
+                return self.execute_rows(groups)
+            self.reconnect(ex)
+            return self.execute(groups)
+
+    def execute(self, groups):
+        cur = self.cnn.cursor()
+        try:
+            for fields, values in groups.iteritems():
+                cur.executemany(self.statement(fields), values)
+            self.cnn.commit()
+        except:
+            self.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def execute_rows(self, groups):
+        r"""one bad row should not lose the whole batch"""
+        errors = 0
+        cur = self.cnn.cursor()
+        try:
+            for fields, values in groups.iteritems():
+                for row in values:
+                    try:
+                        cur.execute(self.statement(fields), row)
+                    except Exception as ex:
+                        if self.is_disconnect(ex):
+                            raise
+                        errors += 1
+                        log.msg('mysql: {}'.format(ex), level=log.DEBUG)
+            self.cnn.commit()
+        finally:
+            cur.close()
+        return errors
+
+    def is_disconnect(self, ex):
+        errno = getattr(ex, 'errno', None)
+        if errno is None and ex.args and isinstance(ex.args[0], int):
+            errno = ex.args[0]
+        return errno in self.disconnect_errors
+
+    def rollback(self):
+        try:
+            self.cnn.rollback()
+        except Exception:
+            pass
+
+    def reconnect(self, ex):
+        self.reconnects += 1
+        log.msg('reconnect mysql({}): {}'.format(self.reconnects, ex), level=log.WARNING)
+        try:
+            self.cnn.close()
+        except Exception:
+            pass
+        self.cnn, _, self.tbl = utils.connect_uri(self.uri)
+
+    def written(self, result):
+        BufferedPipeline.written(self, result)
+        self.set_value('reconnects', self.reconnects)
+
+    def failed(self, failure, rows):
+        BufferedPipeline.failed(self, failure, rows)
+        self.set_value('reconnects', self.reconnects)
+
     def close_spider(self, spider):
         if self.cnn:
-            log.msg('disconnect mysql')
-            self.cur.close()
-            self.cnn.close()
-            self.cnn = self.cur = None
+            return self.close()
+
+    def disconnect(self):
+        log.msg('disconnect mysql')
+        self.cnn.close()
+        self.cnn = None
 
 
 # 消息队列(zmq)
-class ZmqPipeline(object):
+class ZmqPipeline(BufferedPipeline):
+    r"""posts pushed to zmq by a worker thread
+
+    zmq_batch=1 sends one pickled post per frame(as before), larger batches
+    send a zipped list of posts per frame(api.Zipper). With zmq_key the
+    posts are spread over the comma separated endpoints by that field,
+    otherwise zmq load-balances them. A post that cannot be queued within
+    zmq_timeout ms(high water mark reached) is counted in zmq/dropped.
+    """
+
+    name = 'zmq'
+    max_threads = 1
+    default_batch = 1
 
     def open_spider(self, spider):
         if hasattr(spider, 'zmq'):
             try:
-                from utils.api import MessageSender
+                import zmq
+                from webbot.utils.api import MessageSender
                 uri = spider.zmq
                 log.msg('connect <{}>'.format(uri))
-                self.sender = MessageSender(uri)
+                hwm = getattr(spider, 'zmq_hwm', 1000)
+                timeout = getattr(spider, 'zmq_timeout', 0)
+                self.key = getattr(spider, 'zmq_key', None)
+                self.ctx = zmq.Context()
+                if self.key:
+                    self.senders = [MessageSender(i, hwm, timeout, self.ctx) for i in uri.split(',')]
+                else:
+                    self.senders = [MessageSender(uri, hwm, timeout, self.ctx)]
+                self.setup(spider)
+                self.zipped = self.batch>1
                 return
             except Exception as ex:
                 log.err('cannot connect to zmq: {}'.format(ex))
 
-        self.sender = None
+        self.senders = None
 
     def process_item(self, item, spider):
-        if self.sender:
-            try:
-                self.sender.send(item2post(item))
-            except Exception as ex:
-                traceback.print_exc()
+        if self.senders and not unchanged(item):
+            return self.add(item, None, item2post(item))
         return item
 
+    def shard(self, post):
+        if len(self.senders)==1:
+            return 0
+        key = post.get(self.key)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return (zlib.crc32(str(key)) & 0xffffffff) % len(self.senders)
+
+    def write(self, rows):
+        import zmq
+        groups = {}
+        for post in rows:
+            groups.setdefault(self.shard(post), []).append(post)
+
+        dropped = 0
+        for idx, posts in groups.iteritems():
+            sender = self.senders[idx]
+            if self.zipped:
+                try:
+                    sender.zend(posts)
+                except zmq.Again:
+                    dropped += len(posts)
+                continue
+            for post in posts:
+                try:
+                    sender.send(post)
+                except zmq.Again:
+                    dropped += 1
+        return dropped
+
+    def count_errors(self, dropped, count):
+        r"""rows not sent in time are dropped, not failed(zmq/errors: failed writes)"""
+        self.inc_value('dropped', dropped)
+        if dropped:
+            log.msg('zmq: {} of {} rows dropped'.format(dropped, count), level=log.WARNING)
+
     def close_spider(self, spider):
-        if self.sender:
-            log.msg('disconnect zmq')
-            self.sender.term()
+        if self.senders:
+            return self.close()
+
+    def disconnect(self):
+        log.msg('disconnect zmq')
+        for sender in self.senders:
+            sender.term()
+        self.ctx.term()
+        self.senders = None
 
 
 # 图片下载(img)
@@ -222,7 +829,7 @@ try:
 
         def open_spider(self, spider):
 
-            self.img = 'image_urls' in Item.fields
+            self.img = 'image_urls' in spider.item_cls.fields
             self.spiderinfo = self.SpiderInfo(spider)
             if hasattr(spider, 'img'):
                 self.store = self._get_store(spider.img)
@@ -16,16 +16,18 @@ DEFAULT_REQUEST_HEADERS = {
 }
 
 ITEM_PIPELINES = {
-    'webbot.pipelines.BasicPipeline': 0,
-    'webbot.pipelines.MongoPipeline': 1,
-    'webbot.pipelines.MysqlPipeline': 2,
-    'webbot.pipelines.ZmqPipeline': 3,
+    'webbot.pipelines.HttpPipeline': 0,
+    'webbot.pipelines.BasicPipeline': 1,
+    'webbot.pipelines.FingerprintPipeline': 2,
+    'webbot.pipelines.MongoPipeline': 3,
+    'webbot.pipelines.MysqlPipeline': 4,
+    'webbot.pipelines.ZmqPipeline': 5,
     'webbot.pipelines.DebugPipeline': 9,
 }
 
 try:
     from scrapy.contrib.pipeline.images import ImagesPipeline
-    ITEM_PIPELINES['webbot.pipelines.ImgPipeline'] = 4
+    ITEM_PIPELINES['webbot.pipelines.ImgPipeline'] = 6
 except:
     pass
 
@@ -55,3 +57,5 @@ DEFAULT_DEDUP = None
 
 FEED_URI_PARAMS = 'webbot.utils.utils.feed_uri_params_parser'
 IMAGES_STORE = '/tmp'
+CONFIG_CACHE = None # resolved configs/plugins, e.g. '~/.cache/webbot'(private 0700 directory)
+COMMANDS_MODULE = 'webbot.commands'
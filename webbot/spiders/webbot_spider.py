@@ -1,27 +1,29 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
+from collections import OrderedDict
 from cssselect.xpath import HTMLTranslator
 from scrapy import log
 from scrapy import signals
-from scrapy.contrib.linkextractors.sgml import SgmlLinkExtractor
-from scrapy.contrib.loader import ItemLoader
 from scrapy.contrib.spiders import CrawlSpider, Rule
-from scrapy.exceptions import CloseSpider
+from scrapy.exceptions import CloseSpider, DontCloseSpider
 from scrapy.http import Request, FormRequest, HtmlResponse
 from scrapy.item import Item, Field
-from scrapy.selector import Selector
 from scrapy.utils.datatypes import CaselessDict
 from scrapy.utils.misc import arg_to_iter
 from urllib2 import urlparse
 from webbot import settings
-from webbot.utils import parser
+from webbot.utils import docs
+from webbot.utils import extractor
+from webbot.utils import jpath
+from webbot.utils import kwqueue
+from webbot.utils import links
 from webbot.utils import utils
 import Cookie
 import inspect
 import json
-import jsonpath
 import re
+import time
 import traceback
 
 class WebbotSpider(CrawlSpider):
@@ -33,6 +35,7 @@ class WebbotSpider(CrawlSpider):
         CrawlSpider.set_crawler(self, crawler)
         self.config_spider()
         crawler.signals.connect(self.print_msg, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
 
     def config_spider(self):
 
@@ -46,12 +49,16 @@ class WebbotSpider(CrawlSpider):
         self.debug = settings.getbool('debug')
         self.verbose = settings.getint('verbose')
         self.tz = settings.get('tz', '+00:00')
+
+        self.timings = OrderedDict()
+        self.timer = time.time()
+        self.cfg_cache = self.make_cache(settings.get('CONFIG_CACHE'))
         self.conf = self.load_config()
 
         if not self.debug:
             return
 
-        for db in ['mongo', 'mysql', 'zmq']:
+        for db in ['mongo', 'mysql', 'zmq', 'fingerprint']:
             if hasattr(self, db):
                 delattr(self, db)
                 self.disabled.append(db)
@@ -66,11 +73,32 @@ class WebbotSpider(CrawlSpider):
         self.log(u'loading config from <{}>:\n{}'.format(unicode(self.config, encoding='utf-8'),
             json.dumps(self.pretty_conf, indent=2, ensure_ascii=False, sort_keys=False)), level=log.INFO)
 
+        self.log(u'startup time: {} (total={:.3f}s)'.format(
+            u', '.join(u'{}={:.3f}s'.format(k, v) for k,v in self.timings.iteritems()),
+            sum(self.timings.values())), level=log.INFO)
+
+    def make_cache(self, path):
+
+        if not path:
+            return None
+        try:
+            return utils.ConfigCache(path)
+        except Exception as ex:
+            log.msg(u'cannot use config cache <{}>: {}'.format(path, ex), level=log.WARNING)
+            return None
+
+    def mark_time(self, name):
+
+        now = time.time()
+        self.timings[name] = now-self.timer
+        self.timer = now
+
     def load_config(self):
 
-        self.pretty_conf = utils.load_cfg(self.config, pretty=True)
+        self.pretty_conf = utils.load_cfg(self.config, pretty=True, cache=self.cfg_cache)
         conf_dump = json.dumps(self.pretty_conf)
         conf = json.loads(conf_dump)
+        self.mark_time('config')
 
         ### debug
         if self.debug==None:
@@ -88,7 +116,12 @@ class WebbotSpider(CrawlSpider):
 
         ### start_urls
         urls = conf.get('urls', [])
-        self.start_urls = utils.generate_urls(urls, self.macro)
+        self.kw_queue = self.make_kw_queue(urls)
+        if self.kw_queue:
+            kw_obj = dict(urls['keywords'], file=None, incfile=None)
+            self.start_urls = utils.generate_urls(urls, self.macro, utils.load_keywords(kw_obj, seen=self.kw_queue.seen))
+        else:
+            self.start_urls = utils.generate_urls(urls, self.macro)
         if isinstance(urls, dict):
             self.start_method = urls.get('method', 'GET')
             self.make_headers(urls.get('headers', {}))
@@ -120,7 +153,7 @@ class WebbotSpider(CrawlSpider):
             vars = v.get('vars')
 
             rule = Rule(
-                SgmlLinkExtractor(
+                links.LinkExtractor(
                     allow=regex,
                     restrict_xpaths=xpath,
                     process_value=utils.first_n_pages(regex, pages)
@@ -130,7 +163,7 @@ class WebbotSpider(CrawlSpider):
                 callback=callback,
                 follow=follow
             )
-            rule.match = match
+            rule.match = re.compile(match) if match else None
 
             self.rules.append(rule)
         self._compile_rules()
@@ -138,15 +171,61 @@ class WebbotSpider(CrawlSpider):
         if not self.rules:
             self.parse_start_url = self.parse_page
             self.make_page_extractor(conf.get('urls', []))
+        self.mark_time('rules')
 
         ### mappings(loop/fields)
         self.build_item(conf)
+        self.mark_time('fields')
 
         ### settings
         self.load_settings(conf)
+        self.mark_time('settings')
 
         return conf
 
+    def make_kw_queue(self, urls):
+
+        if not (isinstance(urls, dict) and 'keywords' in urls):
+            return None
+
+        kw_obj = urls['keywords']
+        try:
+            source = kwqueue.redis_list(kw_obj.get('file') or kw_obj.get('incfile'))
+        except Exception as ex:
+            log.msg(u'cannot connect keywords queue: {}'.format(ex), level=log.ERROR)
+            raise CloseSpider()
+
+        if not source:
+            return None
+
+        db, key = source
+        self.make_url = utils.url_maker(urls, self.macro)
+        queue = kwqueue.KeywordQueue(db, key,
+            batch=kw_obj.get('batch', 100),
+            seen=utils.load_excluded(kw_obj),
+            stats=self.crawler.stats,
+            spider=self)
+        queue.prime()
+        return queue
+
+    def spider_idle(self, spider):
+
+        if spider is not self or not self.kw_queue:
+            return
+
+        self.crawl_keywords(self.kw_queue.poll())
+        raise DontCloseSpider()
+
+    def crawl_keywords(self, keywords):
+
+        for kw in keywords:
+            try:
+                request = self.make_requests_from_url(self.make_url(kw), kw)
+            except Exception as ex:
+                log.msg(u'cannot generate url of <{}>: {}'.format(kw, ex), level=log.WARNING)
+                continue
+            self.crawler.engine.crawl(request, self)
+
     def load_settings(self, conf):
 
         self.logger = settings.DEFAULT_LOGGER
@@ -159,37 +238,69 @@ class WebbotSpider(CrawlSpider):
         ### parser(html/json)
         if hasattr(self, 'spider') and 'json' in self.spider:
             self.parse_item = self.parse_json_item
+            self.check_json_stream()
         else:
             self.parse_item = self.parse_html_item
 
         ### plugin
         if hasattr(self, 'plugin'):
-            self.plugin = utils.load_plugin(self.plugin)
+            self.plugin = utils.load_plugin(self.plugin, cache=self.cfg_cache)
             self.plugin.spider = self
         else:
             self.plugin = None
 
-    def build_item(self, conf):
+    def check_json_stream(self):
 
-        self.fields = conf['fields']
+        if not getattr(self, 'json_stream', False):
+            self.json_stream = False
+            return
+
+        enc = getattr(self, 'json_enc', 'utf-8').lower().replace('_', '-')
+        if not jpath.ijson:
+            msg = 'ijson is not installed'
+        elif enc not in ['utf-8', 'utf8']:
+            msg = 'unsupported encoding <{}>'.format(enc)
+        elif not jpath.stream_prefix(self.loop):
+            msg = 'unsupported loop <{}>'.format(self.loop)
+        else:
+            return
+
+        log.msg(u'disable json_stream: {}'.format(msg), level=log.WARNING)
+        self.json_stream = False
 
-        for k,v in self.fields.iteritems():
-            Item.fields[k] = Field()
-            for i,j in v.iteritems():
-                Item.fields[k][i] = j
+    def build_item(self, conf):
 
-        if 'image_urls' in Item.fields:
-            Item.fields['images'] = Field()
-            Item.fields['images']['multi'] = True
-            Item.fields['image_urls']['multi'] = True
+        self.fields = conf['fields']
+        self.item_cls = self.make_item_class(self.fields)
 
         self.loop = self.macro.expand(conf.get('loop', ''))
         if self.loop.startswith('css:'):
-            self.loop = self.tr.css_to_xpath(loop[len('css:'):])
+            self.loop = self.tr.css_to_xpath(self.loop[len('css:'):])
+
+        self.plan = extractor.ExtractionPlan(self.fields, self.macro, self.item_cls)
+
+    def make_item_class(self, fields):
+        r"""item class of this spider(Item.fields is shared by all crawlers in process)"""
+
+        attrs = {k:Field(v) for k,v in fields.iteritems()}
+        if 'image_urls' in attrs:
+            attrs['images'] = Field(multi=True)
+            attrs['image_urls']['multi'] = True
+        return type('WebbotItem', (Item,), attrs)
+
+    def get_plan(self, fields):
 
-    def make_requests_from_url(self, url):
+        if fields is self.fields:
+            return self.plan
+        return extractor.ExtractionPlan(fields, self.macro, self.make_item_class(fields))
+
+    def start_requests(self):
+
+        for url, kw in self.start_urls:
+            yield self.make_requests_from_url(url, kw)
+
+    def make_requests_from_url(self, url, kw=''):
 
-        kw = self.macro.query(url)
         us = urlparse.urlsplit(url)
         qstr = dict(urlparse.parse_qsl(us.query))
         base = urlparse.urlunsplit(us._replace(query=''))
@@ -216,8 +327,17 @@ class WebbotSpider(CrawlSpider):
         else:
             return response
 
+    def _parse_response(self, response, callback, cb_kwargs, follow=True):
+
+        try:
+            for x in CrawlSpider._parse_response(self, response, callback, cb_kwargs, follow):
+                yield x
+        finally:
+            docs.release(response)
+
     def parse_page(self, response):
 
+        origin = response
         try:
             response = self.run_plugin(response)
 
@@ -236,39 +356,51 @@ class WebbotSpider(CrawlSpider):
 
             log.msg(u'{}\n{}'.format(response.url, traceback.format_exc()))
 
+        finally:
+
+            if response is not origin:
+                docs.release(response)
+
     def parse_json_item(self, response, loop, fields):
 
         meta = response.meta
-        enc = getattr(self, 'json_enc', 'utf-8')
-        txt = unicode(response.body, encoding=enc, errors='ignore')
+        lr = '[]' if getattr(self, 'json_type', None)=='list' else '{}'
+        prefix = self.json_stream and jpath.stream_prefix(loop)
 
-        if hasattr(self, 'json_type') and self.json_type=='list':
-            l, r = txt.find('['), txt.rfind(']')
+        if prefix:
+            elements = jpath.stream(response.body, prefix, lr)
         else:
-            l, r = txt.find('{'), txt.rfind('}')
-        obj = json.loads(txt[l:r+1])
+            enc = getattr(self, 'json_enc', 'utf-8')
+            txt = unicode(response.body, encoding=enc, errors='ignore')
+            l, r = txt.find(lr[0]), txt.rfind(lr[-1])
+            obj = json.loads(txt[l:r+1])
+            elements = jpath.jsonpath(obj, loop or '$[]') or []
+
         self.macro.update({'URL':response.url, 'keyword':meta.get('keyword', '')})
 
-        for e in jsonpath.jsonpath(obj, loop or '$[]') or []:
+        plan = self.get_plan(fields)
+
+        for e in elements:
 
-            item = Item()
+            item = plan.item_cls()
 
-            for k,v in fields.iteritems():
-                if 'value' in v:
-                    v_x = self.macro.expand(v.get('value'))
-                elif 'jpath' in v:
-                    v_x = jsonpath.jsonpath(e, self.macro.expand(v.get('jpath')))
+            for f in plan.fields:
+                k = f.name
+                if f.kind=='value':
+                    v_x = self.macro.expand(f.expr)
+                elif f.kind=='jpath':
+                    v_x = f.jpath(e) if f.jpath else jpath.jsonpath(e, self.macro.expand(f.expr))
                     v_x = None if v_x==False else v_x
                 else:
                     log.msg(u'field [{}] should contains "value" or "jpath"'.format(k), level=log.WARNING)
                     continue
 
-                val = parser.make_parser(v.get('parse', {}))(v_x)
+                val = f.parser(v_x)
 
-                if not val and 'default' in v:
-                    val = self.macro.expand(v.get('default'))
+                if not val and f.has_default:
+                    val = self.macro.expand(f.default)
 
-                if not (val or v.get('multi') or v.get('opt')):
+                if not (val or f.multi or f.opt):
                     log.msg(u'field [{}] is empty:\n{}'.format(k, item), level=log.WARNING)
                     break
 
@@ -281,46 +413,11 @@ class WebbotSpider(CrawlSpider):
     def parse_html_item(self, response, loop, fields):
 
         meta = response.meta
-        hxs = Selector(response)
+        hxs = docs.get(response).selector
         self.macro.update({'URL':response.url, 'keyword':meta.get('keyword', '')})
 
-        for e in hxs.xpath(loop or '(//*)[1]'):
-
-            loader = ItemLoader(item=Item(), selector=e)
-
-            for k,v in fields.iteritems():
-
-                if 'value' in v:
-                    get_v_x = loader.get_value
-                    v_x = v.get('value')
-                elif 'css' in v:
-                    get_v_x = loader.get_css
-                    v_x = v.get('css')
-                elif 'xpath' in v:
-                    get_v_x = loader.get_xpath
-                    v_x = v.get('xpath')
-                else:
-                    log.msg(u'field [{}] should contains "value", "xpath" or "css"'.format(k), level=log.WARNING)
-                    continue
-
-                val = get_v_x(
-                    self.macro.expand(v_x, meta),
-                    parser.make_parser(v.get('parse', {})),
-                    re=v.get('regex')
-                )
-
-                if not val and 'default' in v:
-                    val = arg_to_iter(self.macro.expand(v.get('default'), meta))
-
-                if not (val or v.get('multi') or v.get('opt')):
-                    log.msg(u'field [{}] is empty:\n{}'.format(k, loader.load_item()), level=log.WARNING)
-                    break
-
-                loader.add_value(k, val)
-
-            else:
-
-                yield loader.load_item()
+        plan = self.get_plan(fields)
+        return plan.extract(hxs.xpath(loop or '(//*)[1]'), meta, getattr(self, 'batch_parse', False))
 
     def sub_links(self, sub):
 
@@ -345,12 +442,13 @@ class WebbotSpider(CrawlSpider):
         if not vars:
             return lambda x:x
 
+        def _values(response):
+            hxs = docs.get(response).selector
+            return {k:(hxs.xpath(v).extract() or [''])[0] for k,v in vars.iteritems() if k.isupper()}
+
         def _proc(request, response):
-            meta = request.meta
-            hxs = Selector(response)
-            for k,v in vars.iteritems():
-                if k.isupper():
-                    meta[k] = (hxs.xpath(v).extract() or [''])[0]
+            values = docs.get(response).memo(('vars', key), lambda: _values(response))
+            request.meta.update(values)
             return request
 
         return _proc
@@ -391,7 +489,7 @@ class WebbotSpider(CrawlSpider):
                 xpath = self.tr.css_to_xpath(css)
             else:
                 xpath = self.macro.expand(pages.get('xpath'))
-            self.page_extractor = SgmlLinkExtractor(
+            self.page_extractor = links.LinkExtractor(
                 allow=regex,
                 restrict_xpaths=xpath,
                 process_value=utils.first_n_pages(regex, pages)
@@ -404,20 +502,21 @@ class WebbotSpider(CrawlSpider):
             return
 
         meta = {k:v for k,v in response.meta.iteritems() if k.isupper()}
+        doc = links.LinkDocument.get(response)
         seen = set()
 
         for n, rule in enumerate(self._rules):
 
             # HACK 1
-            if rule.match and not re.search(rule.match, response.url):
+            if rule.match and not rule.match.search(response.url):
                 continue
 
-            links = [l for l in rule.link_extractor.extract_links(response) if l not in seen]
-            if links and rule.process_links:
-                links = rule.process_links(links)
-            seen = seen.union(links)
+            found = [l for l in rule.link_extractor.extract_from(doc) if l not in seen]
+            if found and rule.process_links:
+                found = rule.process_links(found)
+            seen.update(found)
 
-            for link in links:
+            for link in found:
 
                 r = Request(url=link.url, callback=self._response_downloaded)
                 r.meta.update(rule=n, link_text=link.text)
@@ -14,26 +14,37 @@ except ImportError:
 class MessageSender(object):
     r"""push obj to zmq socket"""
 
-    def __init__(self, uri):
-        r"""create a zmq socket from a uri"""
-        self.ctx = zmq.Context()
+    def __init__(self, uri, hwm=1000, timeout=0, ctx=None):
+        r"""create a zmq socket from a uri(comma separated uris are load-balanced)
+
+        timeout: 0 never blocks, >0 blocks up to timeout ms, <0 blocks forever
+        (zmq.Again is raised when the high water mark is reached)
+        """
+        self.own = ctx is None
+        self.ctx = ctx or zmq.Context()
         self.skt = self.ctx.socket(zmq.PUSH)
         self.skt.setsockopt(zmq.LINGER, 3000)
-        self.skt.connect(uri)
+        self.skt.setsockopt(zmq.SNDHWM, hwm)
+        if timeout>0:
+            self.skt.setsockopt(zmq.SNDTIMEO, timeout)
+        self.flags = zmq.NOBLOCK if timeout==0 else 0
+        for i in uri.split(','):
+            self.skt.connect(i.strip())
 
     def send(self, obj):
         r"""send obj to zmq socket"""
-        self.skt.send_pyobj(obj, flags=zmq.NOBLOCK)
+        self.skt.send_pyobj(obj, flags=self.flags)
 
     def zend(self, obj):
         r"""send zipped obj to zmq socket"""
         buf = Zipper.dumps(obj)
-        self.skt.send(buf, flags=zmq.NOBLOCK)
+        self.skt.send(buf, flags=self.flags)
 
     def term(self):
         r"""close zmq socket"""
         self.skt.close()
-        self.ctx.term()
+        if self.own:
+            self.ctx.term()
 
 
 class Zipper(object):
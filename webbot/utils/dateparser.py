@@ -5,55 +5,115 @@ from datetime import datetime, timedelta
 from collections import OrderedDict
 import re
 
-__all__ = ['parse_date', 'tz_offset']
+__all__ = ['parse_date', 'parse_dates', 'tz_offset']
 
-def parse_date(x, fmt='auto', tz='+00:00', err=None):
+def parse_date(x, fmt='auto', tz='+00:00', err=None, utcnow=None):
 
     """
     Parse datetime `x` with format `fmt` and timezone `tz`.
     Return datetime in UTC
 
+    Results are memoized per minute of `now`(relative dates like "5分钟前"
+    do not change within a minute), except second-scale ones.
+
     :param x: datetime string
     :type x: str
     :param fmt: datetime format
     :type fmt: str
     :param tz: timezone
     :type fmt: str
+    :param utcnow: current time(default: datetime.utcnow())
+    :type utcnow: datetime
     """
 
     try:
 
-        x = unicode(x)
-        fmt = unicode(fmt)
-
-        utcnow = datetime.utcnow()
-        offset = tz_offset(tz)
-        now = utcnow + offset
-
-        if fmt=='auto':
-            date = _parse(x, now)
-        elif fmt in ['epoch', 'unix']:
-            date = datetime.utcfromtimestamp(int(x))
-            offset = timedelta(0)
-        else:
-            date = datetime.strptime(x.encode('utf-8'), fmt.encode('utf-8'))
-
-        return date - offset
+        utcnow = utcnow or datetime.utcnow()
+        key = (x, fmt, tz, utcnow.replace(second=0, microsecond=0))
+        date = _memo.get(key)
+        if date is None:
+            date = _parse_date(unicode(x), unicode(fmt), tz, utcnow)
+            if not (fmt=='auto' and _volatile.search(unicode(x))):
+                _memo.set(key, date)
+        return date
 
     except:
         if err:
             raise
         return datetime.utcfromtimestamp(0)
 
+def parse_dates(xs, fmt='auto', tz='+00:00'):
+    r"""parse_date over a column of values: one `now`, each distinct value parsed once"""
+
+    utcnow = datetime.utcnow()
+    dates = {}
+    results = []
+    for x in xs:
+        try:
+            date = dates[x]
+        except KeyError:
+            date = dates[x] = parse_date(x, fmt, tz, utcnow=utcnow)
+        except TypeError:
+            date = parse_date(x, fmt, tz, utcnow=utcnow)
+        results.append(date)
+    return results
+
+def _parse_date(x, fmt, tz, utcnow):
+
+    offset = tz_offset(tz)
+    now = utcnow + offset
+
+    if fmt=='auto':
+        date = _fast(x) or _parse(x, now)
+    elif fmt in ['epoch', 'unix']:
+        date = datetime.utcfromtimestamp(int(x))
+        offset = timedelta(0)
+    else:
+        date = datetime.strptime(x.encode('utf-8'), fmt.encode('utf-8'))
+
+    return date - offset
+
+class _LRU(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+
+    def get(self, key):
+        value = self.data.pop(key, None)
+        if value is not None:
+            self.data[key] = value
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value
+        if len(self.data)>self.size:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+_memo = _LRU(10000)
+_volatile = re.compile(u'秒|半分')
+_offsets = {}
+
 def tz_offset(tz):
 
+    try:
+        return _offsets[tz]
+    except KeyError:
+        offset = _offsets[tz] = _tz_offset(tz)
+        return offset
+
+def _tz_offset(tz):
+
     tz = tz.lower().strip()
     if tz=='cst':
         offset = timedelta(hours=8)
     elif tz=='utc':
         offset = timedelta()
     else:
-        res = re.search(r'(?P<F>[-+])(?P<HH>\d{2}):?(?P<MM>\d{2})', tz).groupdict()
+        res = _tz.search(tz).groupdict()
         offset = timedelta(
                      hours   = int(res['HH']),
                      minutes = int(res['MM'])
@@ -61,52 +121,104 @@ def tz_offset(tz):
 
     return offset
 
+_tz = re.compile(r'(?P<F>[-+])(?P<HH>\d{2}):?(?P<MM>\d{2})')
+
+# ISO-like dates and timestamps(no chinese to normalize)
+_iso = re.compile(ur'^\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:(?:\s+|T)(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?\s*$')
+_digits = re.compile(ur'^\s*(\d{8}|\d{10}|\d{13})\s*$')
+
+def _fast(x):
+
+    m = _iso.match(x)
+    if m:
+        return datetime(*[int(i) for i in m.groups() if i is not None])
+
+    m = _digits.match(x)
+    if m:
+        return _timestamp(m.group(1))
+
+def _timestamp(i):
+
+    k = len(i)
+    v = int(i)
+    if k == 8:
+        return datetime.strptime(i, '%Y%m%d')
+    elif k == 10:
+        return datetime.fromtimestamp(v)
+    elif k == 13:
+        return datetime.fromtimestamp(v/1000)
+    raise Exception()
+
+_re = dict(
+    now   = re.compile(u'刚刚|刚才'),
+    few   = re.compile(u'几'),
+    day   = re.compile(ur'(?<=[\d半前昨今明后])(天|号)'),
+    sep   = re.compile(ur'(?<=\d)[/.](?=\d)'),
+    junk  = re.compile(ur'[^-:\s\d前后半秒分时日周月年]'),
+    sp1   = re.compile(ur'(?<=\d)\s+(?!\d)'),
+    sp2   = re.compile(ur'(?<!\d)\s+(?=\d)'),
+    sp3   = re.compile(ur'(?<!\d)\s+(?!\d)'),
+    year  = re.compile(ur'(?<!年)(?=(\d+)月(\d+)日)'),
+    ymd   = re.compile(ur'(\d+)年(\d+)月(\d+)日'),
+    date  = re.compile(ur'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})'),
+    time  = re.compile(ur'(?P<hour>\d{1,2}):(?P<minute>\d{1,2})(:(?P<second>\d{1,2}))?'),
+    stamp = re.compile(ur'(?<!\d)(\d{8}|\d{10}|\d{13})(?!\d)'),
+)
+
+_rdays = [(u'前日', -2), (u'昨日', -1), (u'今日', 0), (u'明日', 1), (u'后日', 2)]
+
+_halves = [
+    (u'半分', u'30秒'),
+    (u'半时', u'30分'),
+    (u'半日', u'12时'),
+    (u'半周', u'84时'),
+    (u'半月', u'15日'),
+    (u'半年', u'6月'),
+]
+
+_us = {
+    u'年':'YY',
+    u'月':'mm',
+    u'周':'ww',
+    u'日':'dd',
+    u'时':'HH',
+    u'分':'MM',
+    u'秒':'SS',
+}
+
+_relative = re.compile(ur'(?P<num>\d+)(?P<unit>%s)(?P<flag>前|后)'%(u'|'.join(_us.keys())))
+
 def _parse(x, now=None):
 
     # 当前时间
     now = now or datetime.utcnow()
-    now_SS = date_scale(now, 'SS')
     now_MM = date_scale(now, 'MM')
-    now_HH = date_scale(now, 'HH')
     now_dd = date_scale(now, 'dd')
-    now_mm = date_scale(now, 'mm')
-    now_YY = date_scale(now, 'YY')
 
     # 预处理
-    x = re.sub(u'刚刚|刚才', now_MM.strftime(' %F %T '), x)
-    x = re.sub(u'几', u'0', x)
-    x = re.sub(ur'(?<=[\d半前昨今明后])(天|号)', u'日', x)
+    x = _re['now'].sub(now_MM.strftime(' %F %T '), x)
+    x = _re['few'].sub(u'0', x)
+    x = _re['day'].sub(u'日', x)
 
     one_dd = date_unit('dd')
-    rdays = {
-        u'前日': now_dd-one_dd*2,
-        u'昨日': now_dd-one_dd*1,
-        u'今日': now_dd,
-        u'明日': now_dd+one_dd*1,
-        u'后日': now_dd+one_dd*2,
-    }
-
-    for k,v in rdays.iteritems():
-        x = x.replace(k, v.strftime(' %F '))
-
-    x = re.sub(ur'(?<=\d)[/.](?=\d)', u'-', x)
-    x = re.sub(ur'[^-:\s\d前后半秒分时日周月年]', u'', x)
-    x = re.sub(ur'(?<=\d)\s+(?!\d)', u'', x)
-    x = re.sub(ur'(?<!\d)\s+(?=\d)', u'', x)
-    x = re.sub(ur'(?<!\d)\s+(?!\d)', u'', x)
-    x = re.sub(ur'(?<!年)(?=(\d+)月(\d+)日)', u' %d年'%now.year, x)
-    x = re.sub(ur'(\d+)年(\d+)月(\d+)日', ur'\g<1>-\g<2>-\g<3>', x)
+    for k,v in _rdays:
+        if k in x:
+            x = x.replace(k, (now_dd+one_dd*v).strftime(' %F '))
+
+    x = _re['sep'].sub(u'-', x)
+    x = _re['junk'].sub(u'', x)
+    x = _re['sp1'].sub(u'', x)
+    x = _re['sp2'].sub(u'', x)
+    x = _re['sp3'].sub(u'', x)
+    x = _re['year'].sub(u' %d年'%now.year, x)
+    x = _re['ymd'].sub(ur'\g<1>-\g<2>-\g<3>', x)
     x = x.strip()
 
     if '-' in x or ':' in x:
 
         parts = {}
-        pats = [
-            ur'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})',
-            ur'(?P<hour>\d{1,2}):(?P<minute>\d{1,2})(:(?P<second>\d{1,2}))?',
-        ]
-        for p in pats:
-            m = re.search(p, x)
+        for p in [_re['date'], _re['time']]:
+            m = p.search(x)
             if m:
                 parts.update(m.groupdict())
 
@@ -126,68 +238,38 @@ def _parse(x, now=None):
 
     if u'半' in x:
 
-        halves = {
-            u'半分': u'30秒',
-            u'半时': u'30分',
-            u'半日': u'12时',
-            u'半周': u'84时',
-            u'半月': u'15日',
-            u'半年': u'6月',
-        }
-
-        for k,v in halves.iteritems():
-            x = re.sub(k, v, x)
-
-    us = {
-        u'年':'YY',
-        u'月':'mm',
-        u'周':'ww',
-        u'日':'dd',
-        u'时':'HH',
-        u'分':'MM',
-        u'秒':'SS',
-    }
-    m = re.search(ur'(?P<num>\d+)(?P<unit>%s)(?P<flag>前|后)'%(u'|'.join(us.keys())), x)
+        for k,v in _halves:
+            x = x.replace(k, v)
+
+    m = _relative.search(x)
     if m:
         d = m.groupdict()
         k = d['unit']
         f = -1 if d['flag']==u'前' else 1
         v = f*int(d['num'])
-        u = date_unit(us[k])
-        s = 'dd' if us[k]=='ww' else us[k]
+        u = date_unit(_us[k])
+        s = 'dd' if _us[k]=='ww' else _us[k]
         date = date_scale(now + u*v, s)
         return date
 
-    for i in re.findall(ur'(?<!\d)(\d{8}|\d{10}|\d{13})(?!\d)', x):
-        k = len(i)
-        v = int(i)
-        if k == 8:
-            date = datetime.strptime(i, '%Y%m%d')
-        elif k == 10:
-            date = datetime.fromtimestamp(v)
-        elif k == 13:
-            date = datetime.fromtimestamp(v/1000)
-        else:
-            raise Exception()
-        return date
+    for i in _re['stamp'].findall(x):
+        return _timestamp(i)
 
     raise Exception()
 
+_scales = [
+    ('MS','microsecond'),
+    ('SS','second'),
+    ('MM','minute'),
+    ('HH','hour'),
+    ('dd','day'),
+    ('mm','month'),
+    ('YY','year'),
+]
+
 def date_scale(dt, scale='MM'):
 
-    scales = OrderedDict([
-        ('MS','microsecond'),
-        ('SS','second'),
-        ('MM','minute'),
-        ('HH','hour'),
-        ('dd','day'),
-        ('mm','month'),
-        ('YY','year'),
-    ])
-
-    assert scale in scales
-    
-    for k,v in scales.iteritems():
+    for k,v in _scales:
         if k==scale:
             return dt
         dt = dt.replace(**{v:1 if k in ['dd', 'mm'] else 0})
@@ -210,6 +292,13 @@ def date_unit(unit):
 
 if __name__ == '__main__':
 
+    # correctness and throughput benchmark
+    #
+    #   $ python webbot/utils/dateparser.py [rows]
+
+    import sys
+    import time
+
     xs = [
         u'2014-01-01',
         u'2014/01/01',
@@ -262,12 +351,54 @@ if __name__ == '__main__':
         u'刚才 你去哪了？',
     ]
 
+    fixed = [
+        (u'2014-01-01', datetime(2013, 12, 31, 16)),
+        (u'2014/01/01 01:23:45', datetime(2013, 12, 31, 17, 23, 45)),
+        (u'2014-1-1T1:2', datetime(2013, 12, 31, 17, 2)),
+        (u'2014 年 1 月 1 日', datetime(2013, 12, 31, 16)),
+        (u'20140101', datetime(2013, 12, 31, 16)),
+    ]
+
+    utcnow = datetime.utcnow()
+    offset = tz_offset('cst')
+    failed = 0
+
     for i, x in enumerate(xs):
-        print 'IN [%d]: %s' % (i, x)
-        y = parse_date(x, 'auto', 'cst', True)
-        print 'OUT[%d]: %s [%s]' % (i, y, type(y).__name__)
-        print
+        slow = _parse(x, utcnow+offset)-offset
+        fast = _parse_date(x, u'auto', 'cst', utcnow)
+        ok = slow==fast
+        failed += not ok
+        print '[{:>2}] {:<6} {:<30} {}'.format(i, 'ok' if ok else 'FAILED', x.encode('utf-8'), fast)
+
+    for x, y in fixed:
+        ok = parse_date(x, 'auto', 'cst', True)==y
+        failed += not ok
+        print '[--] {:<6} {:<30} {}'.format('ok' if ok else 'FAILED', x.encode('utf-8'), y)
 
     print '>>>', parse_date('01012014080000', '%m%d%Y%H%M%S', '+08:00')
     print '>>>', parse_date('1400657331', 'epoch', '+08:00')
 
+    # list pages: the same few relative dates repeated over many rows
+    n = int(sys.argv[1]) if len(sys.argv)>1 else 20000
+    page = [u'3分钟前', u'昨天 12:00', u'刚刚', u'2014-05-21 10:30', u'1小时前', u'5月19日', u'1400641135', u'2014/05/20']
+    rows = [page[i%len(page)] for i in xrange(n)]
+
+    def slow(x):
+        now = datetime.utcnow()+offset
+        return _parse(unicode(x), now)-offset
+
+    def uncached(x):
+        return _parse_date(unicode(x), u'auto', 'cst', datetime.utcnow())
+
+    def cached(x):
+        return parse_date(x, 'auto', 'cst')
+
+    print
+    for name, func in [('normalize', slow), ('fast path', uncached), ('memoized', cached)]:
+        start = time.time()
+        for x in rows:
+            func(x)
+        elapsed = time.time()-start
+        print '{:<10} {:>8} dates {:>8.3f}s {:>10.0f} dates/s'.format(name, n, elapsed, n/elapsed)
+
+    sys.exit(1 if failed else 0)
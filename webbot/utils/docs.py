@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from lxml import html
+from scrapy.selector import Selector
+from webbot.utils.utils import LRUCache
+import weakref
+
+__all__ = ['Document', 'get', 'release', 'fragment']
+
+class Document(object):
+    r"""response parsed once, shared by extraction, link rules and vars"""
+
+    def __init__(self, response):
+
+        self.selector = Selector(response)
+        self.root = self.selector._root
+        self.cache = {}
+
+    def memo(self, key, func):
+        r"""derived data computed once per response"""
+
+        try:
+            return self.cache[key]
+        except KeyError:
+            value = self.cache[key] = func()
+            return value
+
+_documents = weakref.WeakKeyDictionary()
+_fragments = LRUCache(64)
+
+def get(response):
+    r"""parsed document of response(cached until released)
+
+    The document keeps a reference to its response, so every response
+    passed in here must be released once it has been processed.
+    """
+
+    doc = _documents.get(response)
+    if doc is None:
+        doc = _documents[response] = Document(response)
+    return doc
+
+def release(response):
+
+    _documents.pop(response, None)
+
+def fragment(data):
+    r"""parsed html fragment(shared by xpath/purge parsers, do not modify)"""
+
+    dom = _fragments.get(data)
+    if dom is None:
+        dom = html.fromstring(data)
+        _fragments.set(data, dom)
+    return dom
+
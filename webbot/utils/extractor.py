@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from lxml import etree
+from scrapy import log
+from scrapy.item import Item
+from scrapy.selector.csstranslator import ScrapyHTMLTranslator
+from scrapy.utils.misc import arg_to_iter, extract_regex
+from scrapy.utils.python import flatten
+from webbot.utils import jpath, parser
+import re
+
+__all__ = ['ExtractionPlan', 'FieldPlan']
+
+NAMESPACES = {
+    're': 'http://exslt.org/regular-expressions',
+    'set': 'http://exslt.org/sets',
+}
+
+_translator = ScrapyHTMLTranslator()
+
+def compile_xpath(query):
+    r"""compile xpath(same namespaces as scrapy.selector.Selector)"""
+    try:
+        return etree.XPath(query, namespaces=NAMESPACES, smart_strings=False)
+    except etree.XPathError:
+        return None
+
+def extract(result, method='html'):
+    r"""convert xpath result to unicode list(same as SelectorList.extract)
+
+    method is the serialization of the selector type: 'xml' for
+    XmlResponse, 'html' otherwise(Selector._tostring_method).
+    """
+    if type(result) is not list:
+        result = [result]
+    values = []
+    for x in result:
+        try:
+            values.append(etree.tostring(x, method=method, encoding=unicode, with_tail=False))
+        except (AttributeError, TypeError):
+            if x is True:
+                values.append(u'1')
+            elif x is False:
+                values.append(u'0')
+            else:
+                values.append(unicode(x))
+    return values
+
+class FieldPlan(object):
+    r"""compiled extraction rule of a single field"""
+
+    def __init__(self, name, inf):
+
+        self.name = name
+        self.inf = inf
+        self.multi = inf.get('multi')
+        self.opt = inf.get('opt')
+        self.has_default = 'default' in inf
+        self.default = inf.get('default')
+        self.parser = parser.make_parser(inf.get('parse', {}))
+
+        regex = inf.get('regex')
+        self.regex = re.compile(regex, re.UNICODE) if regex else None
+
+        for kind in ['value', 'css', 'xpath', 'jpath']:
+            if kind in inf:
+                self.kind = kind
+                self.expr = inf[kind]
+                break
+        else:
+            self.kind = self.expr = None
+
+        # expressions with macros are expanded(and compiled) per response
+        self.static = not (isinstance(self.expr, basestring) and '$' in self.expr)
+        self.xpath = self.jpath = None
+        if self.static and self.kind in ['css', 'xpath']:
+            self.xpath = compile_xpath(self.to_xpath(self.expr))
+        elif self.static and self.kind=='jpath':
+            self.jpath = jpath.make_jpath(self.expr)
+
+    def to_xpath(self, expr):
+
+        return _translator.css_to_xpath(expr) if self.kind=='css' else expr
+
+    def select(self, sel, macro, meta):
+
+        root = sel._root
+        if not hasattr(root, 'xpath'):
+            return []
+
+        xpath = self.xpath
+        if xpath is None:
+            query = self.to_xpath(macro.expand(self.expr, meta))
+            xpath = compile_xpath(query)
+            if xpath is None:
+                # let scrapy report the invalid xpath
+                return sel.xpath(query).extract()
+
+        return extract(xpath(root), getattr(sel, '_tostring_method', 'html'))
+
+    def extract(self, sel, macro, meta):
+        r"""same as ItemLoader.get_value/get_xpath/get_css"""
+
+        value = self.raw(sel, macro, meta)
+
+        if value is not None:
+            value = self.parser(value)
+
+        return self.fill(value, macro, meta)
+
+    def extract_column(self, elements, macro, meta):
+        r"""extract() for all elements, the parsers run once over the column"""
+
+        column = [self.raw(e, macro, meta) for e in elements]
+        live = [i for i,v in enumerate(column) if v is not None]
+        for i,v in zip(live, self.parser.batch([column[i] for i in live])):
+            column[i] = v
+        return [self.fill(v, macro, meta) for v in column]
+
+    def raw(self, sel, macro, meta):
+
+        if self.kind=='value':
+            value = macro.expand(self.expr, meta)
+        else:
+            value = self.select(sel, macro, meta)
+
+        if self.regex:
+            value = flatten([extract_regex(self.regex, x) for x in arg_to_iter(value)])
+
+        return value
+
+    def fill(self, value, macro, meta):
+
+        if self.has_default:
+            if not value:
+                value = arg_to_iter(macro.expand(self.default, meta))
+            elif type(value) is list and len(value)==1 and isinstance(value[0], parser.Lookup):
+                # async http: applied by HttpPipeline if the lookup finds nothing
+                value[0].default = arg_to_iter(macro.expand(self.default, meta))
+
+        return value
+
+class ExtractionPlan(object):
+    r"""compiled fields, built once per config"""
+
+    def __init__(self, fields, macro, item_cls=Item):
+
+        self.macro = macro
+        self.item_cls = item_cls
+        self.fields = [FieldPlan(k, v) for k,v in fields.iteritems()]
+
+    def extract(self, elements, meta, batch=False):
+        r"""yield one item per loop element
+
+        With batch, each field is extracted for all elements of the page
+        first(FieldPlan.extract_column), then the items are assembled.
+        """
+
+        if batch:
+            elements = list(elements)
+            columns = [f.extract_column(elements, self.macro, meta) if f.kind in ['value', 'css', 'xpath'] else None
+                        for f in self.fields]
+
+        for n,e in enumerate(elements):
+
+            values = {}
+
+            for i,f in enumerate(self.fields):
+
+                if f.kind not in ['value', 'css', 'xpath']:
+                    log.msg(u'field [{}] should contains "value", "xpath" or "css"'.format(f.name), level=log.WARNING)
+                    continue
+
+                val = columns[i][n] if batch else f.extract(e, self.macro, meta)
+
+                if not (val or f.multi or f.opt):
+                    log.msg(u'field [{}] is empty:\n{}'.format(f.name, self.make_item(values)), level=log.WARNING)
+                    break
+
+                if val is not None:
+                    val = list(arg_to_iter(val))
+                    if val:
+                        values.setdefault(f.name, []).extend(val)
+
+            else:
+
+                yield self.make_item(values)
+
+    def make_item(self, values):
+
+        item = self.item_cls()
+        for k,v in values.iteritems():
+            item[k] = v
+        return item
+
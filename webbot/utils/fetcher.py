@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from StringIO import StringIO
+from scrapy.utils.url import safe_url_string
+from twisted.internet import defer, reactor
+from twisted.web.client import (Agent, BrowserLikeRedirectAgent, ContentDecoderAgent, FileBodyProducer,
+                                GzipDecoder, HTTPConnectionPool, PartialDownloadError, readBody)
+from twisted.web.http_headers import Headers
+from urlparse import urlparse
+from webbot.utils.utils import LRUCache
+import time
+import urllib
+
+__all__ = ['Fetcher']
+
+class Fetcher(object):
+    r"""non-blocking http lookups over pooled persistent connections
+
+    Responses are cached(LRU, ttl seconds), identical lookups in flight are
+    shared, and at most per_host requests run against one host at a time.
+    """
+
+    def __init__(self, per_host=4, cache=1000, ttl=300, user_agent=None, stats=None, spider=None):
+
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = per_host
+        agent = Agent(reactor, connectTimeout=10, pool=self.pool)
+        agent = BrowserLikeRedirectAgent(agent)
+        self.agent = ContentDecoderAgent(agent, [('gzip', GzipDecoder)])
+        self.per_host = per_host
+        self.cache = LRUCache(cache) if cache else None
+        self.ttl = ttl
+        self.user_agent = user_agent
+        self.stats = stats
+        self.spider = spider
+        self.hosts = {}
+        self.inflight = {}
+
+    def fetch(self, url, method='GET', data=None, timeout=30):
+        r"""Deferred of the response body(str)"""
+
+        url = safe_url_string(url)
+        method = str(method)
+        body = urllib.urlencode(data, doseq=True) if method=='POST' and data else None
+        key = (method, url, body)
+
+        if self.cache is not None:
+            hit = self.cache.get(key)
+            if hit and hit[0]>time.time():
+                self.inc_value('http/cache_hit')
+                return defer.succeed(hit[1])
+
+        if key in self.inflight:
+            self.inc_value('http/shared')
+            dfd = defer.Deferred()
+            self.inflight[key].append(dfd)
+            return dfd
+
+        self.inflight[key] = []
+        self.inc_value('http/request_count')
+        sem = self.hosts.get(urlparse(url).netloc)
+        if sem is None:
+            sem = self.hosts[urlparse(url).netloc] = defer.DeferredSemaphore(self.per_host)
+        dfd = sem.run(self.request, method, url, body, timeout)
+        dfd.addBoth(self.done, key)
+        return dfd
+
+    def request(self, method, url, body, timeout):
+
+        headers = Headers()
+        if self.user_agent:
+            headers.addRawHeader('User-Agent', self.user_agent)
+        producer = None
+        if body is not None:
+            headers.addRawHeader('Content-Type', 'application/x-www-form-urlencoded')
+            producer = FileBodyProducer(StringIO(body))
+
+        dfd = self.agent.request(method, url, headers, producer)
+        dfd.addCallback(readBody)
+        dfd.addErrback(self.partial)
+        timer = reactor.callLater(timeout, dfd.cancel)
+
+        def stop(result):
+            if timer.active():
+                timer.cancel()
+            return result
+
+        return dfd.addBoth(stop)
+
+    def partial(self, failure):
+
+        # body without content-length, ended by closing the connection
+        failure.trap(PartialDownloadError)
+        return failure.value.response
+
+    def done(self, result, key):
+
+        waiters = self.inflight.pop(key, [])
+        if isinstance(result, basestring):
+            if self.cache is not None:
+                self.cache.set(key, (time.time()+self.ttl, result))
+            for dfd in waiters:
+                dfd.callback(result)
+        else:
+            self.inc_value('http/error_count')
+            for dfd in waiters:
+                dfd.errback(result)
+        return result
+
+    def close(self):
+
+        return self.pool.closeCachedConnections()
+
+    def inc_value(self, key, count=1):
+
+        if self.stats:
+            self.stats.inc_value(key, count, spider=self.spider)
+
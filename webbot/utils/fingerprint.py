@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from datetime import datetime
+from struct import pack, unpack
+import anydbm
+import hashlib
+import json
+import re
+
+__all__ = ['ContentFingerprint', 'PendingFingerprint', 'LocalStore', 'RedisStore', 'simhash', 'hamming', 'open_store']
+
+def simhash(texts, size=2):
+    r"""64-bit simhash of texts(character shingles, works without word segmentation)
+
+    Shingle hashes are counted per byte position, so the per-bit weights
+    cost 8 additions per shingle instead of 64.
+    """
+
+    shingles = {}
+    for txt in texts:
+        txt = re.sub(r'(?u)\s+', '', txt)
+        for i in xrange(max(1, len(txt)-size+1)):
+            s = txt[i:i+size]
+            shingles[s] = shingles.get(s, 0)+1
+
+    counts = [[0]*256 for i in xrange(8)]
+    total = 0
+    for s, w in shingles.iteritems():
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        for j, b in enumerate(unpack('8B', hashlib.md5(s).digest()[:8])):
+            counts[j][b] += w
+        total += w
+
+    value = 0
+    for j in xrange(8):
+        for bit in xrange(8):
+            ones = sum(c for b, c in enumerate(counts[j]) if b>>bit&1)
+            if ones*2>total:
+                value |= 1<<(j*8+bit)
+    return value
+
+def hamming(a, b):
+
+    return bin(a^b).count('1')
+
+def dumps(value):
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return unicode(value)
+
+class ContentFingerprint(object):
+    r"""item post => (key, fingerprint)
+
+    key:   md5 of the upsert fields(or url), 8 bytes
+    value: md5 of the other fields(16 bytes) + simhash of text fields(8 bytes, optional)
+    """
+
+    def __init__(self, keys=None, ignore=None, text=None, distance=3):
+
+        self.keys = keys or []
+        self.ignore = set(ignore or [])
+        self.text = set(text or [])
+        self.distance = distance
+
+    def __call__(self, post, url=None):
+
+        exact = {}
+        texts = []
+        for k, v in post.iteritems():
+            if k in self.ignore or k in self.keys:
+                continue
+            elif k in self.text and isinstance(v, basestring):
+                texts.append(v)
+            else:
+                exact[k] = v
+
+        value = hashlib.md5(json.dumps(exact, sort_keys=True, default=dumps)).digest()
+        if self.text:
+            value += pack('<Q', simhash(texts))
+
+        if self.keys:
+            key = json.dumps([post.get(k) for k in self.keys], default=dumps)
+        elif url:
+            key = url.encode('utf-8') if isinstance(url, unicode) else url
+        else:
+            key = value
+        return hashlib.md5(key).digest()[:8], value
+
+    def compare(self, old, new):
+        r"""'new', 'changed', 'unchanged' or 'near'(text differs within distance)"""
+
+        if not old:
+            return 'new'
+        elif old==new:
+            return 'unchanged'
+        elif self.text and len(old)==len(new)==24 and old[:16]==new[:16]:
+            a, = unpack('<Q', old[16:])
+            b, = unpack('<Q', new[16:])
+            if hamming(a, b)<=self.distance:
+                return 'near'
+        return 'changed'
+
+class PendingFingerprint(object):
+    r"""fingerprint of a new/changed item, saved once the item is stored
+
+    Every sink that buffers the item holds it until its batch is written,
+    the item is sealed when it has passed all pipelines(item_scraped). It
+    is saved when sealed and no longer held, and never saved once
+    cancelled(item dropped, write failed or superseded).
+    """
+
+    def __init__(self, key, value, settle):
+
+        self.key = key
+        self.value = value
+        self.settle = settle
+        self.holds = 0
+        self.sealed = False
+        self.done = False
+
+    def hold(self):
+
+        self.holds += 1
+
+    def release(self, ok=True):
+
+        self.holds -= 1
+        if ok:
+            self.check()
+        else:
+            self.cancel()
+
+    def seal(self):
+
+        self.sealed = True
+        self.check()
+
+    def cancel(self):
+
+        if not self.done:
+            self.done = True
+            self.settle(self, False)
+
+    def check(self):
+
+        if self.sealed and self.holds<=0 and not self.done:
+            self.done = True
+            self.settle(self, True)
+
+class LocalStore(object):
+    r"""fingerprints in a local dbm file"""
+
+    remote = False
+
+    def __init__(self, path):
+
+        self.db = anydbm.open(path, 'c')
+
+    def get_many(self, keys):
+
+        return [self.db[k] if self.db.has_key(k) else None for k in keys]
+
+    def set_many(self, mapping):
+
+        for k, v in mapping.iteritems():
+            self.db[k] = v
+
+    def close(self):
+
+        self.db.close()
+
+class RedisStore(object):
+    r"""fingerprints in a redis hash, one round trip per batch"""
+
+    remote = True
+
+    def __init__(self, db, key):
+
+        self.db = db
+        self.key = key
+
+    def get_many(self, keys):
+
+        return self.db.hmget(self.key, keys) if keys else []
+
+    def set_many(self, mapping):
+
+        if mapping:
+            args = []
+            for k, v in mapping.iteritems():
+                args.extend([k, v])
+            self.db.execute_command('HMSET', self.key, *args)
+
+    def close(self):
+
+        pass
+
+def open_store(uri):
+    r"""redis://host:port/db.key => RedisStore, otherwise a dbm file path"""
+
+    if uri.startswith('redis://'):
+        import redis
+        uri, key = uri.rsplit('.', 1)
+        db = redis.StrictRedis.from_url(uri)
+        db.ping()
+        return RedisStore(db, key)
+    return LocalStore(uri)
+
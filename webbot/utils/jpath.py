@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from cStringIO import StringIO
+from decimal import Decimal
+import ast
+import operator
+import re
+
+try:
+    import ijson.backends.yajl2 as ijson
+except ImportError:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+__all__ = ['make_jpath', 'jsonpath', 'stream_prefix', 'stream']
+
+class JsonPath(object):
+    r"""compiled jsonpath expression(same results as jsonpath.jsonpath)"""
+
+    def __init__(self, expr):
+
+        self.expr = expr
+        path = normalize(expr)
+        if path.startswith('$;'):
+            path = path[2:]
+        self.step = _chain(path.split(';') if path else [])
+
+    def __call__(self, obj):
+
+        out = []
+        self.step(obj, out)
+        return out or False
+
+_compiled = {}
+
+def make_jpath(expr):
+    r"""compile expr once(cached by string)"""
+
+    jp = _compiled.get(expr)
+    if jp is None:
+        if len(_compiled)>=4096:
+            _compiled.clear()
+        jp = _compiled[expr] = JsonPath(expr)
+    return jp
+
+def jsonpath(obj, expr):
+    r"""drop-in replacement of jsonpath.jsonpath(obj, expr)"""
+
+    return make_jpath(expr)(obj)
+
+def normalize(x):
+    r"""split expression into ';' separated locations(same as jsonpath.normalize)"""
+
+    subx = []
+    def f1(m):
+        subx.append(m.group(1))
+        return '[#%d]' % (len(subx)-1)
+    x = re.sub(r"[\['](\??\(.*?\))[\]']", f1, x)
+    x = re.sub(r"'?(?<!@)\.'?|\['?", ";", x)
+    x = re.sub(r";;;|;;", ";..;", x)
+    x = re.sub(r";$|'?\]|'$", "", x)
+    x = re.sub(r"#([0-9]+)", lambda m: subx[int(m.group(1))], x)
+    return x
+
+def _store(obj, out):
+
+    out.append(obj)
+
+def _chain(locs):
+
+    step = _store
+    for loc in reversed(locs):
+        step = _step(loc, step)
+    return step
+
+def _step(loc, nxt):
+    r"""compile one location, nxt is the continuation"""
+
+    if loc=='*':
+        def step(obj, out):
+            if isinstance(obj, list):
+                for v in obj:
+                    nxt(v, out)
+            elif isinstance(obj, dict):
+                for k in obj:
+                    nxt(obj[k], out)
+        return step
+
+    if loc=='..':
+        def step(obj, out):
+            nxt(obj, out)
+            if isinstance(obj, list):
+                for v in obj:
+                    step(v, out)
+            elif isinstance(obj, dict):
+                for k in obj:
+                    step(obj[k], out)
+        return step
+
+    if loc=='!':
+        def step(obj, out):
+            if isinstance(obj, dict):
+                for k in obj:
+                    nxt(k, out)
+        return step
+
+    fallback = _fallback(loc, nxt)
+    index = int(loc) if loc.isdigit() else None
+
+    def step(obj, out):
+        if isinstance(obj, dict) and loc in obj:
+            nxt(obj[loc], out)
+        elif isinstance(obj, list) and index is not None:
+            if len(obj)>index:
+                nxt(obj[index], out)
+        elif fallback:
+            fallback(obj, out)
+    return step
+
+def _lookup(obj, key, nxt, out):
+    r"""child by (stringified) key"""
+
+    key = str(key)
+    if isinstance(obj, dict):
+        if key in obj:
+            nxt(obj[key], out)
+    elif isinstance(obj, list) and key.isdigit():
+        if len(obj)>int(key):
+            nxt(obj[int(key)], out)
+
+def _fallback(loc, nxt):
+    r"""index expression, filter, slice and union"""
+
+    # [(index_expression)]
+    if loc.startswith('(') and loc.endswith(')'):
+        evalx = _evaluator(loc)
+        def step(obj, out):
+            _step(str(evalx(obj)), nxt)(obj, out)
+        return step
+
+    # [?(filter_expression)]
+    if loc.startswith('?(') and loc.endswith(')'):
+        test = _evaluator(loc[2:-1])
+        def step(obj, out):
+            if isinstance(obj, list):
+                for v in obj:
+                    if test(v):
+                        nxt(v, out)
+            elif isinstance(obj, dict):
+                for k in obj:
+                    if test(obj[k]):
+                        nxt(obj[k], out)
+        return step
+
+    # [start:end:step]
+    m = re.match(r'(-?[0-9]*):(-?[0-9]*):?(-?[0-9]*)$', loc)
+    if m:
+        s0, s1, s2 = m.groups()
+        def step(obj, out):
+            if not isinstance(obj, (dict, list)):
+                return
+            n = len(obj)
+            start = int(s0) if s0 else 0
+            end = int(s1) if s1 else n
+            inc = int(s2) if s2 else 1
+            start = max(0, start+n) if start<0 else min(n, start)
+            end = max(0, end+n) if end<0 else min(n, end)
+            for i in xrange(start, end, inc):
+                _lookup(obj, i, nxt, out)
+        return step
+
+    # [index,index,...]
+    if ',' in loc:
+        steps = [_step(piece, nxt) for piece in re.split(r"'?,'?", loc)]
+        def step(obj, out):
+            for s in steps:
+                s(obj, out)
+        return step
+
+    return None
+
+_ops = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<':  operator.lt,
+    '<=': operator.le,
+    '>':  operator.gt,
+    '>=': operator.ge,
+}
+
+def _evaluator(loc):
+    r"""compile filter/index expression into a function of @"""
+
+    # simple filter: @.a.b OP literal / @.a.b
+    m = re.match(r'^\s*@((?:\.[a-zA-Z_0-9]+)+)\s*(?:(==|!=|<=|>=|<|>)\s*(.+?))?\s*$', loc)
+    if m and not m.group(1).endswith('.length'):
+        keys = [int(k) if k.isdigit() else k for k in m.group(1)[1:].split('.')]
+        if m.group(2):
+            try:
+                value = ast.literal_eval(m.group(3))
+            except (ValueError, SyntaxError):
+                value = keys = None
+            op = _ops[m.group(2)]
+        else:
+            value = op = None
+        if keys is not None:
+            def test(obj):
+                try:
+                    for k in keys:
+                        obj = obj[k]
+                except Exception:
+                    return False
+                return op(obj, value) if op else obj
+            return test
+
+    # others: python expression(same translation as jsonpath.evalx)
+    code = compile(_pyexpr(loc), '<jpath>', 'eval')
+    def test(obj):
+        try:
+            return eval(code, {}, {'__obj': obj})
+        except Exception:
+            return False
+    return test
+
+def _pyexpr(loc):
+
+    loc = loc.replace('@.length', 'len(__obj)')
+    loc = loc.replace('&&', ' and ').replace('||', ' or ')
+    loc = re.sub(r'!@\.([a-zA-Z@_0-9-]*)', lambda m: "'%s' not in __obj" % m.group(1), loc)
+    def varmatch(m):
+        elts = m.group(1).split('.')
+        ret = '__obj'
+        for e in (elts[1:-1] if elts[-1]=='length' else elts[1:]):
+            ret += '[%s]' % e if e.isdigit() else "['%s']" % e
+        return 'len(%s)' % ret if elts[-1]=='length' else ret
+    loc = re.sub(r'(?<!\\)(@\.[a-zA-Z@_.0-9]+)', varmatch, loc)
+    loc = re.sub(r'(?<!\\)@', '__obj', loc)
+    return loc
+
+def stream_prefix(expr):
+    r"""ijson prefix of a simple loop path($[*], $.data[*], $['a'].b[*]), or None"""
+
+    m = re.match(r"^\$((?:\.\w+|\['[^'.]*'\])*)\[\*\]$", expr or '')
+    if not m:
+        return None
+    keys = [a or b for a,b in re.findall(r"\.(\w+)|\['([^']*)'\]", m.group(1))]
+    return '.'.join(keys+['item'])
+
+def stream(body, prefix, lr='{}'):
+    r"""yield array elements under prefix, one at a time"""
+
+    l, r = body.find(lr[0]), body.rfind(lr[-1])
+    if l<0 or r<l:
+        return
+    for obj in ijson.items(StringIO(buffer(body, l, r-l+1)), prefix):
+        yield _plain(obj)
+
+def _plain(obj):
+    r"""decimal => float(same types as json.loads)"""
+
+    if isinstance(obj, Decimal):
+        return float(obj)
+    elif isinstance(obj, dict):
+        for k,v in obj.iteritems():
+            obj[k] = _plain(v)
+    elif isinstance(obj, list):
+        obj[:] = [_plain(i) for i in obj]
+    return obj
+
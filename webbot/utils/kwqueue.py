@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from scrapy import log
+from twisted.internet import threads
+from twisted.python.failure import Failure
+from webbot.utils import utils
+import time
+
+__all__ = ['KeywordQueue', 'redis_list']
+
+def redis_list(path):
+    r"""(db, key) if path is a redis list(or missing key), else None"""
+
+    if not (path and path.startswith('redis://')):
+        return None
+
+    uri, key = path.rsplit('.', 1)
+    key = key.split('[', 1)[0]
+    cnn, db, tbl = utils.connect_uri(uri)
+    if db.type(key) in ['list', 'none']:
+        return db, key
+    return None
+
+class KeywordQueue(object):
+    r"""keywords consumed from a redis list in batches, off the reactor thread
+
+    The next batch is prefetched while the current one is crawled, so the
+    spider_idle handler(which must not block) always finds work ready
+    unless the list is empty. Keywords already seen(or excluded) are
+    skipped, seen is the container of utils.make_dedup(a bloom filter
+    keeps it bounded) with the excluded keywords loaded.
+    """
+
+    def __init__(self, db, key, batch=100, seen=None, stats=None, spider=None):
+
+        self.db = db
+        self.key = key
+        self.batch = max(1, int(batch))
+        self.seen = set() if seen is None else seen
+        self.stats = stats
+        self.spider = spider
+        self.pending = None
+        self.buffer = []
+        self.consumed = 0
+        self.started = time.time()
+        self.set_value('keywords/excluded', len(self.seen))
+
+    def pop(self):
+        r"""take up to batch keywords(one round trip, atomic)"""
+
+        pipe = self.db.pipeline()
+        pipe.lrange(self.key, 0, self.batch-1)
+        pipe.ltrim(self.key, self.batch, -1)
+        pipe.llen(self.key)
+        words, _, backlog = pipe.execute()
+        return words, backlog
+
+    def poll(self):
+        r"""keywords fetched so far, and prefetch the next batch"""
+
+        words, self.buffer = self.buffer, []
+        self.fetch()
+        return words
+
+    def fetch(self):
+        r"""pop in a thread(one at a time), results are buffered for poll"""
+
+        if not self.pending:
+            self.pending = threads.deferToThread(self.pop)
+            self.pending.addCallbacks(self.received, self.failed)
+        return self.pending
+
+    def prime(self):
+        r"""first batch, popped synchronously before the reactor runs"""
+
+        try:
+            self.received(self.pop())
+        except Exception as ex:
+            self.failed(Failure(ex))
+
+    def received(self, result):
+
+        self.pending = None
+        words, backlog = result
+        accepted = []
+        for w in words:
+            w = utils.to_unicode(w).strip()
+            if w and w not in self.seen:
+                self.seen.add(w)
+                accepted.append(w)
+        words = accepted
+        self.buffer.extend(words)
+        self.update_stats(len(words), backlog)
+        if words:
+            log.msg(u'pop {} keywords from <{}>(backlog={})'.format(len(words), self.key, backlog), level=log.DEBUG)
+
+    def failed(self, failure):
+
+        self.pending = None
+        self.inc_value('redis/exception_count')
+        log.msg(u'cannot pop keywords from <{}>: {}'.format(self.key, failure.getErrorMessage()), level=log.WARNING)
+
+    def update_stats(self, count, backlog):
+
+        self.consumed += count
+        elapsed = max(time.time()-self.started, 1)
+        self.inc_value('keywords/consumed', count)
+        self.set_value('keywords/backlog', backlog)
+        self.set_value('keywords/rate', round(self.consumed*60.0/elapsed, 2))
+
+    def inc_value(self, key, count=1):
+
+        if self.stats:
+            self.stats.inc_value(key, count, spider=self.spider)
+
+    def set_value(self, key, value):
+
+        if self.stats:
+            self.stats.set_value(key, value, spider=self.spider)
+
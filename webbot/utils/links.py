@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from lxml import etree
+from scrapy.link import Link
+from scrapy.linkextractor import IGNORED_EXTENSIONS
+from scrapy.utils.misc import arg_to_iter
+from scrapy.utils.response import get_base_url
+from scrapy.utils.url import canonicalize_url, url_has_any_extension
+from urlparse import urljoin
+from w3lib.url import safe_url_string
+from webbot.utils import docs
+from webbot.utils.extractor import NAMESPACES, compile_xpath
+import re
+
+__all__ = ['LinkDocument', 'LinkExtractor']
+
+class LinkDocument(object):
+    r"""response parsed once, shared by all link rules"""
+
+    def __init__(self, response):
+
+        self.url = response.url
+        self.encoding = response.encoding
+        self.base_url = get_base_url(response)
+        self.root = docs.get(response).root
+        self.regions = {}
+        self.joined = {}
+
+    @classmethod
+    def get(cls, response):
+        r"""link document shared by all extractors of response"""
+
+        return docs.get(response).memo('links', lambda: cls(response))
+
+    def anchors(self, key, xpaths):
+        r"""(element, href) of <a>/<area> inside restrict_xpaths(cached)"""
+
+        anchors = self.regions.get(key)
+        if anchors is None:
+            if xpaths:
+                elements = []
+                for xp in xpaths:
+                    if callable(xp):
+                        res = xp(self.root)
+                    else:
+                        res = self.root.xpath(xp, namespaces=NAMESPACES)
+                    elements.extend(e for e in arg_to_iter(res) if etree.iselement(e))
+            else:
+                elements = [self.root]
+            anchors = [(a, a.get('href')) for e in elements for a in e.iter('a', 'area') if a.get('href') is not None]
+            self.regions[key] = anchors
+        return anchors
+
+    def join(self, url):
+
+        joined = self.joined.get(url)
+        if joined is None:
+            joined = safe_url_string(urljoin(self.base_url, url), self.encoding)
+            self.joined[url] = joined
+        return joined
+
+class LinkExtractor(object):
+    r"""lxml link extractor, compatible with SgmlLinkExtractor(allow/restrict_xpaths/process_value)"""
+
+    def __init__(self, allow=(), restrict_xpaths=(), process_value=None, deny_extensions=None, canonicalize=True):
+
+        self.allow_res = [x if hasattr(x, 'search') else re.compile(x) for x in arg_to_iter(allow)]
+        self.key = tuple(arg_to_iter(restrict_xpaths))
+        self.xpaths = [compile_xpath(x) or x for x in self.key]
+        self.process_value = process_value
+        if deny_extensions is None:
+            deny_extensions = IGNORED_EXTENSIONS
+        self.deny_extensions = set(['.'+e for e in arg_to_iter(deny_extensions)])
+        self.canonicalize = canonicalize
+
+    def extract_links(self, response):
+
+        return self.extract_from(LinkDocument.get(response))
+
+    def extract_from(self, doc):
+
+        links = []
+        seen = set()
+
+        for a, value in doc.anchors(self.key, self.xpaths):
+
+            if self.process_value:
+                value = self.process_value(value.encode(doc.encoding, 'xmlcharrefreplace'))
+                if value is None:
+                    continue
+
+            url = doc.join(value)
+            if not self.allowed(url):
+                continue
+            if self.canonicalize:
+                url = canonicalize_url(url)
+            if url in seen:
+                continue
+            seen.add(url)
+
+            text = u''.join(a.itertext()).strip()
+            nofollow = a.get('rel')=='nofollow'
+            links.append(Link(url=url, text=text, nofollow=nofollow))
+
+        return links
+
+    def allowed(self, url):
+
+        if url.split('://', 1)[0] not in ('http', 'https', 'file'):
+            return False
+        if self.allow_res and not any(r.search(url) for r in self.allow_res):
+            return False
+        if self.deny_extensions and url_has_any_extension(url, self.deny_extensions):
+            return False
+        return True
+
@@ -4,22 +4,25 @@
 from HTMLParser import HTMLParser
 from datetime import datetime
 from functools import partial
-from jsonpath import jsonpath
-from lxml import html
+from lxml import etree, html
 from lxml.html.clean import Cleaner
 from scrapy import log
 from scrapy.contrib.loader.processor import *
 from scrapy.utils.markup import remove_tags
 from scrapy.utils.misc import arg_to_iter
 from scrapy.utils.python import flatten
+from webbot.utils import docs
+from webbot.utils.jpath import make_jpath
 import base64
+import copy
 import inspect
+import operator
 import re
 import requests
 import sys
 
 try:
-    from webbot.utils.dateparser import parse_date
+    from webbot.utils.dateparser import parse_date, parse_dates
 except:
     pass
 
@@ -29,6 +32,12 @@ except ImportError:
     import json
 
 class BaseParser(object):
+    r"""compiled once(make_parser), then called for every value
+
+    Subclasses build patterns/xpaths/options in __init__, so parse only
+    does the per-value work. batch(rows) is the columnar form of __call__:
+    the values of all rows are parsed in one pass(column), then regrouped.
+    """
 
     def __init__(self, inf):
 
@@ -38,16 +47,66 @@ class BaseParser(object):
     def parse(self, data):
 
         return data
-    
+
     def __call__(self, data):
 
-        return flatten(MapCompose(self.parse)(data))
+        # same as MapCompose(self.parse), without its per-call setup
+        values = []
+        parse = self.parse
+        for v in arg_to_iter(data):
+            values += arg_to_iter(parse(v))
+        return flatten(values)
+
+    def batch(self, rows):
+        r"""[data, ...] => [self(data), ...]"""
+
+        values = []
+        bounds = []
+        for data in rows:
+            values.extend(data if type(data) is list else arg_to_iter(data))
+            bounds.append(len(values))
+        return regroup(self.column(values), bounds)
+
+    def column(self, values):
+        r"""[value, ...] => [self.parse(value), ...]"""
+
+        parse = self.parse
+        return [parse(v) for v in values]
+
+def regroup(results, bounds):
+    r"""column of parse results => rows(same flattening as BaseParser.__call__)"""
+
+    rows = []
+    i = 0
+    for end in bounds:
+        values = []
+        while i<end:
+            x = results[i]
+            i += 1
+            if x is None:
+                continue
+            elif hasattr(x, '__iter__'):
+                values.extend(flatten(arg_to_iter(x)))
+            else:
+                values.append(x)
+        rows.append(values)
+    return rows
 
 class GrepParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(GrepParser, self).__init__(inf)
+        self.regex = re.compile(self.inf.get('pattern', '.+'))
+
     def parse(self, data):
 
-        return re.findall(self.inf.get('pattern', '.+'), data)
+        return self.regex.findall(data)
+
+    def column(self, values):
+
+        findall = self.regex.findall
+        return [findall(data) for data in values]
 
 class HeadParser(BaseParser):
 
@@ -55,90 +114,175 @@ class HeadParser(BaseParser):
 
         return data[:1]
 
+    def batch(self, rows):
+
+        return [data[:1] for data in rows]
+
 class TailParser(BaseParser):
 
     def __call__(self, data):
 
         return data[1:]
 
+    def batch(self, rows):
+
+        return [data[1:] for data in rows]
+
 class LastParser(BaseParser):
 
     def __call__(self, data):
 
         return data[-1:]
 
+    def batch(self, rows):
+
+        return [data[-1:] for data in rows]
+
 class LenParser(BaseParser):
 
     def __call__(self, data):
 
         return len(data)
 
+    def batch(self, rows):
+
+        return [len(data) for data in rows]
+
 class JoinParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(JoinParser, self).__init__(inf)
+        self.join = Join(self.inf.get('sep', u' '))
+
     def __call__(self, data):
 
         data = BaseParser.__call__(self, data)
-        sep = self.inf.get('sep', u' ')
-        return [Join(sep)(data)]
+        return [self.join(data)]
+
+    def batch(self, rows):
 
-class ListParser(BaseParser):
+        join = self.join
+        return [[join(data)] for data in BaseParser.batch(self, rows)]
+
+class ListParser(JoinParser):
 
     def parse(self, data):
 
         return remove_tags(data).strip()
 
+class HttpParser(BaseParser):
+    r"""fetch urls(GET/POST), values are the decoded response bodies
+
+    With "async": true, the fetch is deferred: the value becomes a Lookup
+    resolved by HttpPipeline(non-blocking, pooled, cached).
+    """
+
+    session = None
+
+    def __init__(self, inf):
+
+        super(HttpParser, self).__init__(inf)
+        self.method = self.inf.get('method', 'get').upper()
+        self.data = self.inf.get('data', {})
+        self.enc = self.inf.get('enc', 'utf-8')
+        self.timeout = self.inf.get('timeout', 30)
+        self.deferred = self.inf.get('async', False) and self.method in ['GET', 'POST']
+
     def __call__(self, data):
 
-        data = BaseParser.__call__(self, data)
-        sep = self.inf.get('sep', u' ')
-        return [Join(sep)(data)]
+        if self.deferred:
+            urls = list(arg_to_iter(data))
+            return [Lookup(self, urls)] if urls else []
+        return BaseParser.__call__(self, data)
 
-class HttpParser(BaseParser):
+    def batch(self, rows):
+
+        if self.deferred:
+            return [self(data) for data in rows]
+        return BaseParser.batch(self, rows)
 
     def parse(self, data):
 
         url = data
-        m = self.inf.get('method', 'get').upper()
-        d = self.inf.get('data', {})
-        e = self.inf.get('enc', 'utf-8')
-        if m=='GET':
-            return requests.get(url).content.decode(e)
-        elif m=='POST':
-            return requests.get(url, data=d).content.decode(e)
+        if self.method=='GET':
+            return self.get_session().get(url, timeout=self.timeout).content.decode(self.enc)
+        elif self.method=='POST':
+            return self.get_session().post(url, data=self.data, timeout=self.timeout).content.decode(self.enc)
         else:
             return data
 
+    def decode(self, body):
+
+        return body.decode(self.enc)
+
+    @classmethod
+    def get_session(cls):
+
+        if cls.session is None:
+            cls.session = requests.Session()
+        return cls.session
+
+class Lookup(object):
+    r"""pending http lookups of a field value(async http parser)"""
+
+    def __init__(self, parser, urls):
+
+        self.parser = parser
+        self.urls = urls
+        self.then = []
+        self.default = None
+
+    def resolve(self, bodies):
+        r"""fetched bodies => field value(parsers after http applied)"""
+
+        data = [self.parser.decode(b) for b in bodies]
+        for p in self.then:
+            if data is None:
+                break
+            data = p(data)
+        return data
+
 class MapParser(BaseParser):
 
-    def parse(self, data):
+    def __init__(self, inf):
 
-        m = self.inf.get('map')
-        d = self.inf.get('default')
-        for k,v in m.iteritems():
+        super(MapParser, self).__init__(inf)
+        self.default = self.inf.get('default')
+        self.rules = []
+        for k,v in self.inf.get('map').iteritems():
             if not k.startswith('^'):
                 k = '.*'+k
             if not k.endswith('$'):
                 k = k+'.*'
-            if re.search(k, data):
-                return re.sub(k, v, data)
+            self.rules.append((re.compile(k), v))
+
+    def parse(self, data):
+
+        for regex,v in self.rules:
+            if regex.search(data):
+                return regex.sub(v, data)
         else:
-            return d
+            return self.default
 
 class XpathParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(XpathParser, self).__init__(inf)
+        self.xpath = etree.XPath(self.inf['query'])
+
     def parse(self, data):
 
-        qs = self.inf['query']
-        dom = html.fromstring(data)
-        return dom.xpath(qs)
+        dom = docs.fragment(data)
+        return self.xpath(dom)
 
-class PurgeParser(BaseParser):
+class PurgeParser(XpathParser):
 
     def parse(self, data):
 
-        qs = self.inf['query']
-        dom = html.fromstring(data)
-        es = dom.xpath(qs)
+        dom = copy.deepcopy(docs.fragment(data))
+        es = self.xpath(dom)
         for e in es:
             if e in dom:
                 dom.remove(e)
@@ -146,81 +290,125 @@ class PurgeParser(BaseParser):
 
 class JpathParser(BaseParser):
 
-    def parse(self, data):
+    def __init__(self, inf):
 
-        qs = self.inf.get('query')
+        super(JpathParser, self).__init__(inf)
+        self.jpath = make_jpath(self.inf.get('query'))
         t = self.inf.get('type', 'object')
         if t=='object':
-            lr = '{}'
+            self.lr = '{}'
         else:
-            lr = '[]'
-        l,r = data.find(lr[0]),data.rfind(lr[-1])
+            self.lr = '[]'
+
+    def parse(self, data):
+
+        l,r = data.find(self.lr[0]),data.rfind(self.lr[-1])
         data = data[l:r+1]
-        return jsonpath(json.loads(data), qs)
+        return self.jpath(json.loads(data))
 
 class FloatParser(BaseParser):
 
+    regex = re.compile(r'([+-])?\s*[.0-9]+')
+
     def parse(self, data):
 
         try:
             data = data.replace(',', '')
-            data = re.search(r'([+-])?\s*[.0-9]+', data).group(0)
+            data = self.regex.search(data).group(0)
             return float(data)
         except:
             return 0.0
 
+    def column(self, values):
+
+        search = self.regex.search
+        results = []
+        for data in values:
+            try:
+                results.append(float(search(data.replace(',', '')).group(0)))
+            except:
+                results.append(0.0)
+        return results
+
 class IntParser(BaseParser):
 
+    regex = re.compile(r'([+-])?\s*[0-9]+')
+
     def parse(self, data):
 
         try:
             data = data.replace(',', '')
-            data = re.search(r'([+-])?\s*[0-9]+', data).group(0)
+            data = self.regex.search(data).group(0)
             return int(data)
         except:
             return 0
 
+    def column(self, values):
+
+        search = self.regex.search
+        results = []
+        for data in values:
+            try:
+                results.append(int(search(data.replace(',', '')).group(0)))
+            except:
+                results.append(0)
+        return results
+
 class EpochParser(BaseParser):
 
+    zero = datetime.utcfromtimestamp(0)
+
     def parse(self, data):
 
         try:
-            zero = datetime.utcfromtimestamp(0)
-            epoch = int((data-zero).total_seconds())
+            epoch = int((data-self.zero).total_seconds())
             return epoch
         except:
             return 0
 
 class DefaultParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(DefaultParser, self).__init__(inf)
+        self.value = self.inf.get('value')
+
     def parse(self, data):
 
         if not data:
-            return self.inf.get('value')
+            return self.value
         else:
             return data
 
 class UnescParser(BaseParser):
 
-    def parse(self, data):
+    def __init__(self, inf):
 
-        return HTMLParser().unescape(data)
+        super(UnescParser, self).__init__(inf)
+        self.parse = HTMLParser().unescape
 
 class DateParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(DateParser, self).__init__(inf)
+        self.fmt = self.inf.get('fmt', 'auto')
+        self.tz = self.inf.get('tz', '+00:00')
+
     def parse(self, data):
 
-        fmt = self.inf.get('fmt', 'auto')
-        tz = self.inf.get('tz', '+00:00')
-        return parse_date(data, fmt, tz)
+        return parse_date(data, self.fmt, self.tz)
 
-class CstParser(BaseParser):
+    def column(self, values):
 
-    def parse(self, data):
+        return parse_dates(values, self.fmt, self.tz)
 
-        fmt = self.inf.get('fmt', 'auto')
-        tz = '+08:00'
-        return parse_date(data, fmt, tz)
+class CstParser(DateParser):
+
+    def __init__(self, inf):
+
+        super(CstParser, self).__init__(inf)
+        self.tz = '+08:00'
 
 class Base64Parser(BaseParser):
 
@@ -229,10 +417,14 @@ class Base64Parser(BaseParser):
 
 class CleanParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(CleanParser, self).__init__(inf)
+        self.cleaner = Cleaner(style=True, scripts=True, javascript=True, links=True, meta=True)
+
     def parse(self, data):
         try:
-            cleaner = Cleaner(style=True, scripts=True, javascript=True, links=True, meta=True)
-            return cleaner.clean_html(data)
+            return self.cleaner.clean_html(data)
         except:
             return data
 
@@ -241,14 +433,18 @@ class SubParser(BaseParser):
     def __init__(self, inf):
 
         super(SubParser, self).__init__(inf)
-        self.fm = self.inf['from']
+        self.fm = re.compile(self.inf['from'])
         self.to  = arg_to_iter(self.inf['to'])
-        #self.parse = partial(re.sub, fm, to)
 
     def parse(self, data):
 
         for to in self.to:
-            yield re.sub(self.fm, to, data)
+            yield self.fm.sub(to, data)
+
+    def column(self, values):
+
+        sub = self.fm.sub
+        return [[sub(to, data) for to in self.to] for data in values]
 
 class TextParser(BaseParser):
 
@@ -268,11 +464,15 @@ class StrParser(BaseParser):
 
 class StringParser(BaseParser):
 
+    def __init__(self, inf):
+
+        super(StringParser, self).__init__(inf)
+        self.method = self.inf['method']
+        self.args = self.inf.get('args', [])
+        self.kwargs = self.inf.get('kwargs', {})
+
     def parse(self, data):
-        method = self.inf['method']
-        args = self.inf.get('args', [])
-        kwargs = self.inf.get('kwargs', {})
-        return getattr(data, method)(*args, **kwargs)
+        return getattr(data, self.method)(*self.args, **self.kwargs)
 
 class TrimParser(BaseParser):
 
@@ -281,48 +481,67 @@ class TrimParser(BaseParser):
 
 class NormParser(BaseParser):
 
+    regex = re.compile(r'\s+')
+
     def parse(self, data):
-        return re.sub(r'\s+', ' ', data).strip()
+        return self.regex.sub(' ', data).strip()
 
-class FilterParser(BaseParser):
+    def column(self, values):
 
-    def filter(self, op, x, y):
+        # one sub over the joined column(\x00 is not whitespace)
+        if values and all(type(v) is unicode and u'\x00' not in v for v in values):
+            return [v.strip() for v in self.regex.sub(' ', u'\x00'.join(values)).split(u'\x00')]
+        return BaseParser.column(self, values)
 
-        if self.inf.get('swap'):
-            x,y = y,x
+class FilterParser(BaseParser):
 
-        return {
-            '$in':  lambda: x in y,
-            '$nin': lambda: x not in y,
-            '$eq':  lambda: x == y,
-            '$ne':  lambda: x != y,
-            '$lt':  lambda: x < y,
-            '$lte': lambda: x <= y,
-            '$gt':  lambda: x > y,
-            '$gte': lambda: x >= y,
-            '$regex': lambda: re.search(y, x),
-        }[op]()
+    operators = {
+        '$in':  lambda x,y: x in y,
+        '$nin': lambda x,y: x not in y,
+        '$eq':  operator.eq,
+        '$ne':  operator.ne,
+        '$lt':  operator.lt,
+        '$lte': operator.le,
+        '$gt':  operator.gt,
+        '$gte': operator.ge,
+        '$regex': lambda x,y: y.search(x),
+    }
 
-    def parse(self, data):
+    def __init__(self, inf):
 
-        for k,v in self.inf.iteritems():
+        super(FilterParser, self).__init__(inf)
+        self.negate = bool(self.inf.get('not'))
+        self.tests = [t for t in (self.compile(k, v) for k,v in self.inf.iteritems()) if t]
+
+    def compile(self, k, v):
+        r"""operator => test(data), built once"""
+
+        swap = self.inf.get('swap')
+        if k in ['type', 'args', 'kwargs', 'not', 'swap']:
+            return
+        elif k=='delta':
+            return lambda data: (datetime.utcnow()-data).total_seconds()<v
+        elif k=='string':
+            args = self.inf.get('args', [])
+            kwargs = self.inf.get('kwargs', {})
+            return lambda data: getattr(data, v)(*args, **kwargs)
+        elif k in self.operators:
+            op = self.operators[k]
+            if k=='$regex':
+                if swap:
+                    return lambda data: re.search(data, v)
+                v = re.compile(v)
+            if swap:
+                return lambda data: op(v, data)
+            return lambda data: op(data, v)
+        else:
+            log.msg(u'invalid operator <{}>'.format(k), level=log.WARNING)
 
-            if k in ['type', 'args', 'kwargs', 'not', 'swap']:
-                continue
-            elif k=='delta':
-                now = datetime.utcnow()
-                ok = (now-data).total_seconds()<v
-            elif k=='string':
-                args = self.inf.get('args', [])
-                kwargs = self.inf.get('kwargs', {})
-                ok = getattr(data, v)(*args, **kwargs)
-            elif k.startswith('$'):
-                ok = self.filter(k, data, v)
-            else:
-                log.msg(u'invalid operator <{}>'.format(k), level=log.WARNING)
-                continue
+    def parse(self, data):
 
-            if self.inf.get('not'):
+        for test in self.tests:
+            ok = test(data)
+            if self.negate:
                 ok = not ok
             if not ok:
                 return
@@ -347,10 +566,39 @@ class PipeParser(BaseParser):
 
         super(PipeParser, self).__init__(inf)
         self.parsers = [make_parser(i) for i in self.inf]
-        self.func = Compose(*self.parsers)
 
     def __call__(self, data):
-        return self.func(data)
+
+        # same as Compose(*self.parsers), without its per-call setup
+        for i,p in enumerate(self.parsers):
+            if data is None:
+                break
+            data = p(data)
+            if type(data) is list and len(data)==1 and isinstance(data[0], Lookup):
+                # the rest runs once the lookup is resolved
+                data[0].then.extend(self.parsers[i+1:])
+                break
+        return data
+
+    def batch(self, rows):
+
+        rows = list(rows)
+        live = [i for i,data in enumerate(rows) if data is not None]
+        for i,p in enumerate(self.parsers):
+            if not live:
+                break
+            results = p.batch([rows[j] for j in live])
+            alive = []
+            for j,data in zip(live, results):
+                rows[j] = data
+                if data is None:
+                    continue
+                elif type(data) is list and len(data)==1 and isinstance(data[0], Lookup):
+                    data[0].then.extend(self.parsers[i+1:])
+                    continue
+                alive.append(j)
+            live = alive
+        return rows
 
 all_parsers = {
     cname[0:-6].lower():cls\
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+__all__ = ['SinkWorker']
+
+class SinkWorker(object):
+    r"""dedicated thread pool for blocking sink writes, with a bounded queue
+
+    Jobs run in submission order when threads=1. The queue is measured in
+    rows: once maxsize rows are queued, wait() returns a Deferred fired
+    when a job finishes and there is room again(backpressure).
+    """
+
+    def __init__(self, name, threads=1, maxsize=10000):
+
+        self.name = name
+        self.threads = max(1, threads)
+        self.maxsize = max(1, maxsize)
+        self.pool = ThreadPool(1, self.threads, name='webbot-{}'.format(name))
+        self.sem = defer.DeferredSemaphore(self.threads)
+        self.size = 0
+        self.active = set()
+        self.waiters = []
+        self.trigger = None
+
+    def start(self):
+
+        self.pool.start()
+        self.trigger = reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+
+        if self.trigger:
+            reactor.removeSystemEventTrigger(self.trigger)
+            self.trigger = None
+            self.pool.stop()
+
+    def submit(self, size, func, *args, **kw):
+        r"""run func(*args, **kw) in the pool, size rows are queued until it is done"""
+
+        self.size += size
+        dfd = self.sem.run(threads.deferToThreadPool, reactor, self.pool, func, *args, **kw)
+        self.active.add(dfd)
+        dfd.addBoth(self.done, dfd, size)
+        return dfd
+
+    def done(self, result, dfd, size):
+
+        self.size -= size
+        self.active.discard(dfd)
+        while self.waiters and not self.full():
+            self.waiters.pop(0).callback(None)
+        return result
+
+    def full(self, extra=0):
+
+        return self.size+extra>=self.maxsize
+
+    def wait(self):
+
+        dfd = defer.Deferred()
+        self.waiters.append(dfd)
+        return dfd
+
+    def join(self):
+        r"""fired when all submitted jobs(and their callbacks) are done"""
+
+        return defer.DeferredList(list(self.active))
+
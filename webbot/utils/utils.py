@@ -14,26 +14,25 @@ from scrapy.exceptions import CloseSpider
 from scrapy.utils.markup import remove_tags
 from scrapy.utils.url import canonicalize_url
 from urllib import urlencode
-from urllib2 import urlopen, urlparse
+from urllib2 import HTTPError, Request, urlopen, urlparse
 import base64
 import codecs
+import functools
 import hashlib
 import imp
 import json
-import jsonpath
 import math
 import os.path
 import pprint
 import re
+import stat
 import string
+import struct
 import tempfile
 import time
 import unicodedata
-import uuid
 import zlib
 
-MAGIC = str(uuid.uuid4())
-
 try:
     from cPickle import pickle
 except ImportError:
@@ -121,11 +120,48 @@ def connect_uri(uri):
 
     return (cnn, db, tbl)
 
-def hash_url(url):
+def hash_url(url, fmt='hex'):
+    r"""sha1 of canonical url: hex(40 chars), raw16 or raw8(leading bytes of the digest)"""
     url = canonicalize_url(url)
     sha1 = hashlib.sha1()
     sha1.update(url)
-    return sha1.hexdigest()
+    if fmt=='hex':
+        return sha1.hexdigest()
+    return sha1.digest()[:FP_SIZES[fmt]]
+
+FP_SIZES = {'raw16':16, 'raw8':8}
+
+class UrlFingerprint(object):
+    r"""url => (redis key, member) of the dedup set, canonicalization memoized
+
+    With buckets>0, members are spread over urlset:0 .. urlset:<buckets-1>,
+    small sorted sets are stored by redis in its compact(ziplist) encoding.
+    """
+
+    def __init__(self, fmt='hex', buckets=0, key='urlset', cache=100000):
+        if fmt!='hex' and fmt not in FP_SIZES:
+            raise Exception('unknown fingerprint <{}>'.format(fmt))
+        self.fmt = fmt
+        self.buckets = int(buckets or 0)
+        self.name = key
+        self.cache = LRUCache(cache)
+
+    def fp(self, url):
+        fp = self.cache.get(url)
+        if fp is None:
+            fp = hash_url(url, self.fmt)
+            self.cache.set(url, fp)
+        return fp
+
+    def key(self, fp):
+        if not self.buckets:
+            return self.name
+        raw = fp.decode('hex') if self.fmt=='hex' else fp
+        return '{}:{}'.format(self.name, struct.unpack('<I', raw[:4])[0]%self.buckets)
+
+    def convert(self, hexfp):
+        r"""legacy hex member => member of this format"""
+        return hexfp if self.fmt=='hex' else hexfp.decode('hex')[:FP_SIZES[self.fmt]]
 
 def to_unicode(txt):
     if type(txt)==unicode:
@@ -136,7 +172,7 @@ def to_unicode(txt):
     else:
         return u''
 
-def load_file(path):
+def load_file(path, count=1000):
 
     if os.path.exists(path):
         path = os.path.abspath(path)
@@ -144,7 +180,7 @@ def load_file(path):
 
     try:
         if path.startswith('redis://') or path.startswith('mongodb://'):
-            for line in load_db(path):
+            for line in load_db(path, count):
                 yield to_unicode(line)
         else:
             for line in urlopen(path, timeout=30):
@@ -152,7 +188,12 @@ def load_file(path):
     except Exception as ex:
         log.msg(u'cannot load file <{}>'.format(path.decode('utf-8')), level=log.ERROR)
 
-def load_db(uri):
+def load_db(uri, count=1000):
+    r"""stream words of redis(set/zset/hash/list/string) or mongo, count per round trip
+
+    Words are not deduplicated here(SSCAN/HSCAN may repeat a few), callers
+    that need unique words(load_keywords) do it themselves.
+    """
 
     uri, key = uri.rsplit('.', 1)
     gd = re.match(r'^(?P<key>[^[]+)(\[(?P<start>\d*):(?P<stop>\d*)\])?$', key).groupdict()
@@ -165,21 +206,18 @@ def load_db(uri):
     if uri.startswith('redis://'):
         t = rdb.type(key)
         if t=='set':
-            words = rdb.smembers(key)
+            words = rdb.sscan_iter(key, count=count)
         elif t=='zset':
-            words = rdb.zrange(key, start, stop)
+            words = chunked(rdb.zrange, key, start, stop, count)
         elif t=='hash':
-            words = rdb.hvals(key)
+            words = (v for k,v in rdb.hscan_iter(key, count=count))
         elif t=='string':
             words = [rdb.get(key)]
-        elif t=='list' or t=='none':
-            # RUN FOREVER
-            while True:
-                word = rdb.blpop(key, 1)
-                if word:
-                    yield word[1]
-                else:
-                    yield MAGIC
+        elif t=='list':
+            # snapshot, spider consumes list keywords with kwqueue.KeywordQueue
+            words = chunked(rdb.lrange, key, start, stop, count)
+        elif t=='none':
+            words = []
         else:
             log.msg(u'invalid type <{}>({})'.format(key, t), level=log.WARNING)
             words = []
@@ -187,113 +225,320 @@ def load_db(uri):
     elif uri.startswith('mongodb://'):
         span = stop-start+1
         span = span if span>0 else 0
-        words = [u'{}'.format(i[key]) for i in tbl.find({}, {key:1}).skip(start).limit(span)]
+        cursor = tbl.find({}, {key:1, '_id':0}).skip(start).limit(span).batch_size(count)
+        words = (u'{}'.format(i[key]) for i in cursor if key in i)
 
     elif uri.startswith('tcp://'):
         # FIXME: support zmq
-        pass
+        words = []
 
-    for word in set(words):
+    for word in words:
         yield word
 
-def load_cfg(path, pretty=False):
+def chunked(fetch, key, start, stop, count):
+    r"""read index range [start, stop](stop=-1 means end) count items at a time"""
+
+    while stop<0 or start<=stop:
+        end = start+count-1
+        if stop>=0:
+            end = min(end, stop)
+        words = fetch(key, start, end)
+        for word in words:
+            yield word
+        if len(words)<end-start+1:
+            break
+        start = end+1
+
+def load_cfg(path, pretty=False, cache=None):
     Dict = OrderedDict if pretty else dict
-    cfg = json.loads(''.join(load_file(path)), object_pairs_hook=Dict)
+    if cache:
+        text = cache.resolved(path)
+        if text:
+            return json.loads(text, object_pairs_hook=Dict)
+    sources = []
+    cfg = _load_cfg(path, Dict, cache, sources)
+    if cache:
+        cache.save_resolved(path, json.dumps(cfg), sources)
+    return cfg
+
+def _load_cfg(path, Dict, cache, sources):
+    if cache:
+        text, validator = cache.fetch(path)
+        sources.append([cache.key(path), validator])
+    else:
+        text, validator = ''.join(load_file(path)), None
+    cfg = json.loads(text, object_pairs_hook=Dict)
     if 'base' in cfg:
-        cfg = Dict(load_cfg(cfg['base'], pretty).items()+cfg.items())
+        cfg = Dict(_load_cfg(cfg['base'], Dict, cache, sources).items()+cfg.items())
         del cfg['base']
     return cfg
 
-def load_plugin(path):
+def load_plugin(path, cache=None):
+    r"""plugin module of path, named by path and source(plugins of different configs never share a module)"""
+    if cache:
+        text, validator = cache.fetch(path)
+    else:
+        text = ''.join(load_file(path))
+    name = 'webbot_plugin_{}'.format(sha1(repr((path, text))))
+    if cache:
+        return imp.load_source(name, cache.save_plugin(text))
     fd, fn = tempfile.mkstemp()
-    os.write(fd, ''.join(load_file(path)).encode('utf-8'))
-    mod = imp.load_source('plugin', fn)
+    os.write(fd, text.encode('utf-8'))
+    os.close(fd)
+    mod = imp.load_source(name, fn)
     os.remove(fn)
     if os.path.exists(fn+'c'):
         os.remove(fn+'c')
     return mod
 
-def generate_urls(obj, macro):
+def sha1(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+class ConfigCache(object):
+    r"""on-disk cache of configs/plugins, revalidated by mtime or ETag/Last-Modified
+
+    Plugins are executed from here, so the cache must be a private(0700)
+    directory of the current user, and every file is checked for owner
+    and content hash before it is used.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root, 0700)
+        st = os.lstat(self.root)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid!=os.getuid() or st.st_mode&0077:
+            raise IOError('<{}> is not a private(0700) directory of the current user'.format(self.root))
+
+    def filename(self, kind, key, ext='json'):
+        return os.path.join(self.root, '{}-{}.{}'.format(kind, sha1(key), ext))
+
+    def key(self, path):
+        r"""local paths are keyed by absolute path"""
+
+        if path.startswith('file://'):
+            path = path[len('file://'):]
+        elif '://' in path:
+            return path
+        return os.path.abspath(path)
+
+    def trusted(self, fn):
+        r"""regular file of the current user, not writable by others"""
+
+        try:
+            st = os.lstat(fn)
+        except OSError:
+            return False
+        return stat.S_ISREG(st.st_mode) and st.st_uid==os.getuid() and not st.st_mode&0022
+
+    def read(self, fn):
+        if not self.trusted(fn):
+            return None
+        try:
+            with open(fn) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('sha1')!=sha1(entry.get('text', '')):
+            return None
+        return entry
+
+    def dump(self, fn, entry):
+        entry['sha1'] = sha1(entry['text'])
+        self.write(fn, json.dumps(entry))
+
+    def write(self, fn, data):
+        # atomic, many jobs share one cache
+        tmp = '{}.{}'.format(fn, os.getpid())
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        fd = os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp, fn)
+
+    def fetch(self, path):
+        r"""(text, validator) of path, validator is None if it cannot be revalidated"""
+
+        local = path[len('file://'):] if path.startswith('file://') else path
+        if os.path.exists(local):
+            st = os.stat(local)
+            with codecs.open(local, encoding='utf-8') as f:
+                return f.read(), ['mtime', st.st_mtime, st.st_size]
+
+        if not (path.startswith('http://') or path.startswith('https://')):
+            return ''.join(load_file(path)), None
+
+        fn = self.filename('url', path)
+        entry = self.read(fn)
+        req = Request(path)
+        if entry:
+            kind, etag, modified = entry['validator']
+            if etag:
+                req.add_header('If-None-Match', etag)
+            if modified:
+                req.add_header('If-Modified-Since', modified)
+
+        try:
+            rsp = urlopen(req, timeout=30)
+        except HTTPError as ex:
+            if ex.code==304 and entry:
+                return entry['text'], entry['validator']
+            log.msg(u'cannot load file <{}>'.format(path.decode('utf-8')), level=log.ERROR)
+            return u'', None
+        except Exception as ex:
+            log.msg(u'cannot load file <{}>'.format(path.decode('utf-8')), level=log.ERROR)
+            return u'', None
+
+        text = to_unicode(rsp.read())
+        etag = rsp.info().getheader('ETag')
+        modified = rsp.info().getheader('Last-Modified')
+        if not (etag or modified):
+            return text, None
+
+        validator = ['http', etag, modified]
+        self.dump(fn, {'text':text, 'validator':validator})
+        return text, validator
+
+    def valid(self, path, validator):
+        return validator is not None and self.fetch(path)[1]==validator
+
+    def resolved(self, path):
+        r"""resolved config text if none of its sources changed"""
+
+        entry = self.read(self.filename('cfg', self.key(path)))
+        if entry and all(self.valid(p, v) for p,v in entry['sources']):
+            return entry['text']
+
+    def save_resolved(self, path, text, sources):
+        if all(v for p,v in sources):
+            self.dump(self.filename('cfg', self.key(path)), {'text':text, 'sources':sources})
+
+    def save_plugin(self, text):
+        r"""plugin file named by content hash(keeps its .pyc across runs)"""
+
+        text = text.encode('utf-8')
+        fn = self.filename('plugin', text, 'py')
+        pyc = fn+'c'
+        if os.path.lexists(pyc) and not self.trusted(pyc):
+            os.remove(pyc)
+        if not (self.trusted(fn) and self.digest(fn)==sha1(text)):
+            if os.path.lexists(pyc):
+                os.remove(pyc)
+            self.write(fn, text)
+        return fn
+
+    def digest(self, fn):
+        try:
+            with open(fn, 'rb') as f:
+                return sha1(f.read())
+        except IOError:
+            return None
+
+def generate_urls(obj, macro, keywords=None):
+    r"""yield (url, keyword), the keyword goes with the request(meta)"""
     try:
         if type(obj)==list:
             for url in obj:
-                yield macro.expand(url)
+                yield macro.expand(url), ''
 
         elif type(obj)==dict:
-            base = macro.expand(obj['base'].encode('utf-8'))
-            us = urlparse.urlsplit(base)
-            qstr = dict(urlparse.parse_qsl(us.query))
-            qstr.update(obj.get('qstr', {}))
-            base = urlparse.urlunsplit(us._replace(query=''))
-
-            for k,v in qstr.iteritems():
-                if type(v)==dict and type(v['val'])==unicode:
-                    v = v['val'].encode(v.get('enc', 'utf-8'), errors='ignore')
-                qstr[k] = macro.expand(v)
-
+            make_url = url_maker(obj, macro)
             if 'keywords' in obj:
-                kw_obj = obj['keywords']
-
-                sub = kw_obj.get('sub')
-                if sub:
-                    frm = sub.get('from')
-                    to = sub.get('to')
-                    sub = functools.partial(re.sub, frm, to)
-                else:
-                    sub = lambda x:x
-
-                for kw in load_keywords(kw_obj):
-
-                    if kw==MAGIC:
-                        yield 'http://0.0.0.0'
-                        continue
-
-                    key = kw_obj['name'].encode('utf-8')
-                    val = kw
-                    col = kw_obj.get('col', 0)
-                    sep = kw_obj.get('sep')
-                    if col>0:
-                        val = val.split(sep)[col-1]
-                    val = sub(val)
-                    if kw_obj.get('query', True):
-                        qstr.update({key:val})
-                        url = base+'?'+urlencode(qstr)
-                    else:
-                        val = val.encode(kw_obj.get('enc', 'utf-8'), errors='ignore') if type(val)==unicode else str(val)
-                        url = base.replace(key, val)+'?'+urlencode(qstr)
-                    macro.update({'sep':sep})
-                    macro.bind(url, kw)
-                    yield url
+                for kw in (load_keywords(obj['keywords']) if keywords is None else keywords):
+                    yield make_url(kw), kw
             else:
-                url = base+'?'+urlencode(qstr)
-                yield url
+                yield make_url(None), ''
 
     except Exception as ex:
         log.msg(u'cannot generate urls: {}'.format(ex), level=log.ERROR)
         raise CloseSpider()
 
-def load_keywords(kw_obj, msg='keywords'):
+def url_maker(obj, macro):
+    r"""keyword => url of urls(dict)"""
+
+    base = macro.expand(obj['base'].encode('utf-8'))
+    us = urlparse.urlsplit(base)
+    qstr = dict(urlparse.parse_qsl(us.query))
+    qstr.update(obj.get('qstr', {}))
+    base = urlparse.urlunsplit(us._replace(query=''))
+
+    for k,v in qstr.iteritems():
+        if type(v)==dict and type(v['val'])==unicode:
+            v = v['val'].encode(v.get('enc', 'utf-8'), errors='ignore')
+        qstr[k] = macro.expand(v)
+
+    if 'keywords' not in obj:
+        return lambda kw: base+'?'+urlencode(qstr)
+
+    kw_obj = obj['keywords']
+
+    sub = kw_obj.get('sub')
+    if sub:
+        frm = sub.get('from')
+        to = sub.get('to')
+        sub = functools.partial(re.sub, frm, to)
+    else:
+        sub = lambda x:x
+
+    key = kw_obj['name'].encode('utf-8')
+    col = kw_obj.get('col', 0)
+    sep = kw_obj.get('sep')
+    macro.update({'sep':sep})
+
+    def _make(kw):
+        val = kw
+        if col>0:
+            val = val.split(sep)[col-1]
+        val = sub(val)
+        if kw_obj.get('query', True):
+            qstr.update({key:val})
+            return base+'?'+urlencode(qstr)
+        else:
+            val = val.encode(kw_obj.get('enc', 'utf-8'), errors='ignore') if type(val)==unicode else str(val)
+            return base.replace(key, val)+'?'+urlencode(qstr)
+
+    return _make
+
+def make_dedup(kw_obj):
+    r"""seen-keywords container of keywords.dedup: "set"(default), "bloom" or {"type":"bloom", ...}"""
+
+    dedup = kw_obj.get('dedup') or 'set'
+    if not isinstance(dedup, dict):
+        dedup = {'type':dedup}
+    kind = dedup.get('type', 'set')
+    if kind=='set':
+        return set()
+    elif kind=='bloom':
+        return BloomFilter(dedup.get('capacity', 10000000), dedup.get('error', 0.001))
+    else:
+        raise Exception('unknown dedup <{}>'.format(kind))
+
+def load_excluded(kw_obj):
 
-    seen = set()
+    seen = make_dedup(kw_obj)
+    excfile = kw_obj.get('excfile')
+    if excfile:
+        for line in load_file(excfile, kw_obj.get('count', 1000)):
+            kw = line.strip()
+            if kw and not kw.startswith('#'):
+                seen.add(kw)
+        log.msg(u'load {} excluded keywords from <{}>'.format(len(seen), to_unicode(excfile)))
+    return seen
+
+def load_keywords(kw_obj, msg='keywords', seen=None):
 
     if type(kw_obj)==dict:
 
-        excfile = kw_obj.get('excfile')
-        if excfile:
-            for line in load_file(excfile):
-                kw = line.strip()
-                if kw and not kw.startswith('#'):
-                    seen.add(kw)
+        if seen is None:
+            seen = load_excluded(kw_obj)
 
         incfile = kw_obj.get('file') or kw_obj.get('incfile')
         if incfile:
-            for line in load_file(incfile):
+            for line in load_file(incfile, kw_obj.get('count', 1000)):
                 kw = line.strip()
-
-                if kw==MAGIC:
-                    yield kw
-                    continue
-
                 if kw and not kw.startswith('#'):
                     if kw not in seen:
                         seen.add(kw)
@@ -352,25 +597,111 @@ class UnicodePrinter(pprint.PrettyPrinter):
             return ('"%s"'%v.encode('utf8'), True, False)
         return pprint.PrettyPrinter.format(self, obj, context, maxlevels, level)
 
-class MacroExpander(object):
+class LRUCache(object):
+    r"""bounded mapping, evicts the least recently used key"""
 
-    def __init__(self, env):
-        self.bindings = dict()
-        self.macros = dict()
-        self.macros.update(env)
+    def __init__(self, size=1024):
+        self.size = size
+        self.data = OrderedDict()
 
-    def bind(self, url, kw):
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        self.data[key] = value
+        return value
+
+    def set(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data)>self.size:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.data.pop(key, default)
+
+    def clear(self):
+        self.data.clear()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+class BloomFilter(object):
+    r"""probabilistic set(add/in only), false positive rate is error up to capacity keys"""
+
+    def __init__(self, capacity=10000000, error=0.001):
+        self.capacity = int(capacity)
+        self.error = float(error)
+        self.bits = int(math.ceil(-self.capacity*math.log(self.error)/math.log(2)**2))
+        self.hashes = max(1, int(round(self.bits*math.log(2)/self.capacity)))
+        self.array = bytearray((self.bits+7)//8)
+        self.count = 0
+        self.last = (None, None)
+
+    def offsets(self, key):
+        # "kw not in seen" is followed by "seen.add(kw)", hash once
+        if key==self.last[0]:
+            return self.last[1]
+        raw = key.encode('utf-8') if isinstance(key, unicode) else key
+        # 32-bit halves keep the arithmetic in machine ints
+        h1, h2 = struct.unpack('<II', hashlib.md5(raw).digest()[:8])
+        h2 |= 1
+        bits = self.bits
+        offsets = [(h1+i*h2)%bits for i in xrange(self.hashes)]
+        self.last = (key, offsets)
+        return offsets
+
+    def add(self, key):
+        array = self.array
+        for i in self.offsets(key):
+            array[i>>3] |= 1<<(i&7)
+        self.count += 1
+        if self.count==self.capacity+1:
+            log.msg(u'bloom filter is over capacity({}), false positives will increase'.format(self.capacity), level=log.WARNING)
+
+    def __contains__(self, key):
+        array = self.array
+        for i in self.offsets(key):
+            if not array[i>>3]&(1<<(i&7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+class MacroExpander(object):
 
-        self.bindings[url] = kw
+    TIME_MACROS = frozenset([
+        'UTCNOW', 'NOW', 'TODAY', 'ITODAY',
+        'YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND',
+        'IYEAR', 'IMONTH', 'IDAY', 'IHOUR', 'IMINUTE', 'ISECOND',
+        'UNOW', 'UTODAY', 'UENDDAY',
+    ])
 
-    def query(self, url):
+    MAX_TEMPLATES = 4096
 
-        return self.bindings.get(url, '')
+    def __init__(self, env):
+        self.macros = dict()
+        self.macros.update(env)
+        self.templates = dict()
+        self.clock = None
+        self.times = dict()
 
     def update(self, env={}):
-        now = datetime.now().replace(microsecond=0)
-        utcnow = datetime.utcnow().replace(microsecond=0)
-        self.macros.update({
+        self.macros.update(env)
+
+    def now(self):
+        r"""time macros, refreshed when the wall-clock second changes"""
+        sec = int(time.time())
+        if sec!=self.clock:
+            now = datetime.fromtimestamp(sec)
+            utcnow = datetime.utcfromtimestamp(sec)
+            today = now.replace(hour=0, minute=0, second=0)
+            self.times = {
                 'UTCNOW':   utcnow.strftime('%Y-%m-%d %H:%M:%S'),
                 'NOW':      now.strftime('%Y-%m-%d %H:%M:%S'),
                 'TODAY':    now.strftime('%Y-%m-%d'),
@@ -390,30 +721,53 @@ class MacroExpander(object):
                 'IMINUTE':  str(now.minute),
                 'ISECOND':  str(now.second),
 
-                'UNOW':     str(int(time.time())),
-                'UTODAY':   str(int(time.mktime(time.strptime(now.strftime('%Y-%m-%d'), '%Y-%m-%d')))),
-                'UENDDAY':  str(int(time.mktime(time.strptime(now.strftime('%Y-%m-%d 23:59:59'), '%Y-%m-%d %H:%M:%S'))))
-        })
-        self.macros.update(env)
+                'UNOW':     str(sec),
+                'UTODAY':   str(int(time.mktime(today.timetuple()))),
+                'UENDDAY':  str(int(time.mktime(today.replace(hour=23, minute=59, second=59).timetuple())))
+            }
+            self.clock = sec
+        return self.times
+
+    def compile(self, value):
+        r"""parse template once per distinct string"""
+        tpl = self.templates.get(value)
+        if tpl is None:
+            if len(self.templates)>=self.MAX_TEMPLATES:
+                self.templates.clear()
+            names = set()
+            cols = []
+            for m in string.Template.pattern.finditer(value):
+                name = m.group('named') or m.group('braced')
+                if name:
+                    names.add(name)
+                if m.group('braced') and re.match(r'^COL\d+$', name):
+                    cols.append((name, int(name[3:])))
+            tpl = (string.Template(value), cols, bool(names & self.TIME_MACROS))
+            self.templates[value] = tpl
+        return tpl
 
     def expand(self, value, env={}):
         if type(value)!=str and type(value)!=unicode:
             return value
+        if '$' not in value:
+            return value
 
-        kw = self.macros.get('keyword', '')
-        sep = self.macros.get('sep')
-        for key,col in re.findall(r'\$\{(COL(\d+))\}', value):
-            col = int(col)
-            if col==0:
-                v = kw
-            else:
-                v = kw.split(sep)[col-1]
-            env[key] = v
-
+        tpl, cols, timed = self.compile(value)
         env = {k:v for k,v in env.iteritems() if k.isupper()}
-        self.update()
+
+        if cols:
+            kw = self.macros.get('keyword', '')
+            sep = self.macros.get('sep')
+            for key,col in cols:
+                if col==0:
+                    v = kw
+                else:
+                    v = kw.split(sep)[col-1]
+                env[key] = v
+
         env.update(self.macros)
-        tpl = string.Template(value)
+        if timed:
+            env.update(self.now())
         return tpl.safe_substitute(env)
 
 def first_n_pages(pattern, pages):